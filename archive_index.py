@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Локальный индекс архива файлов Байкал (SQLite).
+
+Для каждого файла хранится абсолютный путь, станция, каналы, время начала
+и конца, dt, kan и razr. При повторном сканировании заново читаются только
+файлы, у которых изменились размер или время модификации.
+
+    python archive_index.py build [seisobr]
+    python archive_index.py find 2013-02-14T01:52:17
+    python archive_index.py check -D 1
+"""
+import os
+import argparse
+import datetime
+import calendar
+import sqlite3
+
+from baikal import BaikalHeader, set_packed24
+from util import (DATA_DIR, SELECT_ALL_FILES, db_path2filename, execute_query,
+    setup_db_connection)
+
+
+INDEX_FILE = "seisobr_index.sqlite"
+
+CREATE_TABLES = """\
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    valid INTEGER,
+    station TEXT,
+    channels TEXT,
+    starttime REAL,
+    endtime REAL,
+    dt REAL,
+    kan INTEGER,
+    razr INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_time ON files (starttime, endtime);
+"""
+
+
+def datetime2timestamp(dt):
+    """ datetime (без часового пояса) -> число секунд с 1970 г. """
+    return calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6
+
+
+def timestamp2datetime(ts):
+    """ число секунд с 1970 г. -> datetime """
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=ts)
+
+
+class ArchiveIndex(object):
+    """ индекс файлов архива в базе SQLite """
+    def __init__(self, filename=INDEX_FILE):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(CREATE_TABLES)
+
+    def close(self):
+        self.conn.close()
+
+    def _header_row(self, filename):
+        """ значения для таблицы из заголовков файла (None - не Байкал) """
+        try:
+            header = BaikalHeader(filename)
+            if not header.valid:
+                return
+            main = header.main_header
+            channels = ",".join(ch.name_chan for ch in header.channels)
+            return (1, main.station, channels,
+                datetime2timestamp(header.get_datetime()),
+                datetime2timestamp(header.get_endtime()),
+                main.dt, main.kan, main.razr)
+        except (ValueError, IOError), msg:
+            print("Error in file %s with msg: %s" % (filename, msg))
+
+    def update(self, top=DATA_DIR):
+        """ (пере)сканировать папку top; читаются только новые и изменённые
+        файлы, записи удалённых файлов убираются из индекса """
+        known = dict((row[0], row[1:]) for row in
+            self.conn.execute("SELECT path, mtime, size FROM files"))
+        seen = set()
+        changed, unchanged = 0, 0
+        # пути в индексе - абсолютные, чтобы одна и та же папка, указанная
+        # по-разному (или из другой текущей папки), не давала дубликатов
+        top = os.path.abspath(top)
+        for root, dirs, files in os.walk(top):
+            dirs.sort()
+            for fname in sorted(files):
+                filename = os.path.abspath(os.path.join(root, fname))
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                seen.add(filename)
+                if known.get(filename) == (st.st_mtime, st.st_size):
+                    unchanged += 1
+                    continue
+                row = self._header_row(filename)
+                # файлы не формата Байкал тоже запоминаем, чтобы не читать
+                # их при каждом сканировании
+                if row is None:
+                    row = (0, None, None, None, None, None, None, None)
+                self.conn.execute("INSERT OR REPLACE INTO files VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (filename, st.st_mtime, st.st_size) + row)
+                changed += 1
+        # удалённые файлы (только внутри сканируемой папки); записи старых
+        # индексов с относительными путями тоже убираются - файлы уже
+        # записаны заново с абсолютными
+        prefix = os.path.join(top, "")
+        removed = [path for path in known if path not in seen and
+                   os.path.abspath(path).startswith(prefix)]
+        self.conn.executemany("DELETE FROM files WHERE path = ?",
+            [(path,) for path in removed])
+        self.conn.commit()
+        return changed, unchanged, len(removed)
+
+    def find(self, dt):
+        """ файлы, содержащие момент времени dt (datetime) """
+        ts = datetime2timestamp(dt)
+        rows = self.conn.execute("SELECT path FROM files WHERE valid = 1 "
+            "AND starttime <= ? AND endtime >= ? ORDER BY station, path",
+            (ts, ts))
+        return [row[0] for row in rows]
+
+    def find_range(self, starttime, endtime):
+        """ файлы, пересекающиеся с интервалом времени [starttime, endtime] """
+        rows = self.conn.execute("SELECT path FROM files WHERE valid = 1 "
+            "AND starttime <= ? AND endtime >= ? ORDER BY starttime, station",
+            (datetime2timestamp(endtime), datetime2timestamp(starttime)))
+        return [row[0] for row in rows]
+
+    def check_drift(self, cursor, database=1):
+        """ сверка индекса с базой данных: возвращает (файлы из базы данных,
+        которых нет в индексе; файлы индекса, неизвестные базе данных) """
+        query = SELECT_ALL_FILES.replace("1", str(database))
+        items = execute_query(cursor, query, ()) or []
+        in_db = set()
+        for Dir, fname in items:
+            try:
+                in_db.add(os.path.abspath(db_path2filename(Dir, fname)))
+            except ValueError:
+                # путь не внутри DATA_DIR
+                continue
+        in_index = set(os.path.abspath(row[0]) for row in
+            self.conn.execute("SELECT path FROM files WHERE valid = 1"))
+        return sorted(in_db - in_index), sorted(in_index - in_db)
+
+
+def main():
+    """ построение индекса и поиск по нему из командной строки """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-x", "--index", default=INDEX_FILE,
+        help="Archive index file.")
+    subparsers = parser.add_subparsers(dest="command")
+    build = subparsers.add_parser("build", help="Scan directory and update index.")
+    build.add_argument("directory", nargs="?", default=DATA_DIR)
+    build.add_argument("--packed24", action="store_true", default=False,
+        help="Read razr=24 files as packed 3-byte samples.")
+    find = subparsers.add_parser("find", help="Find files containing datetime.")
+    find.add_argument("datetime",
+        help="Datetime to search (format like 2013-02-14T01:52:17).")
+    check = subparsers.add_parser("check", help="Compare index with database.")
+    check.add_argument("-D", "--database", type=int, default=1, choices=(1, 2))
+    options = parser.parse_args()
+    #
+    index = ArchiveIndex(options.index)
+    if options.command == "build":
+        set_packed24(options.packed24)
+        changed, unchanged, removed = index.update(options.directory)
+        print("Indexed %d files (%d unchanged, %d removed)" % (changed,
+            unchanged, removed))
+    elif options.command == "find":
+        try:
+            dt = datetime.datetime.strptime(options.datetime, "%Y-%m-%dT%H:%M:%S")
+        except ValueError, e:
+            print('Error! Specify datetime to search in format "YYYY-mm-ddTHH:MM:SS"', e)
+            return
+        for filename in index.find(dt):
+            print(filename)
+    elif options.command == "check":
+        result = setup_db_connection()
+        if result is None:
+            print("Failed to connect db! Exiting.")
+            return
+        conn, cursor = result
+        not_indexed, not_in_db = index.check_drift(cursor, options.database)
+        for filename in not_indexed:
+            print("not in index: %s" % filename)
+        for filename in not_in_db:
+            print("not in database: %s" % filename)
+        print("%d files missing in index, %d files unknown to database" % (
+            len(not_indexed), len(not_in_db)))
+        conn.close()
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Автоматические пикировки P и S (AR picker ObsPy) по многим станциям
+в пуле процессов.
+
+Отсчёты компонент Z, N, E всех станций копируются один раз в общую
+память (multiprocessing.RawArray), процессы получают только смещения
+в ней, а не сами массивы.
+"""
+import ctypes
+import multiprocessing
+
+import numpy as np
+
+from obspy.signal import arPick
+
+
+def ar_params(options):
+    """ параметры arPick из опций командной строки (порядок как в arPick) """
+    return (options.ar_f1, options.ar_f2, options.ar_lta_p, options.ar_sta_p,
+            options.ar_lta_s, options.ar_sta_s, options.ar_m_p, options.ar_m_s,
+            options.ar_l_p, options.ar_l_s)
+
+
+def stream_components(st):
+    """ массивы Z, N, E потока (None, если какой-то компоненты нет) """
+    try:
+        return [st.select(component=comp)[0].data for comp in "ZNE"]
+    except IndexError:
+        return
+
+
+# общая память с отсчётами (в процессах пула)
+_shared = None
+
+
+def _init_worker(buf):
+    global _shared
+    _shared = np.frombuffer(buf, dtype=np.float32)
+
+
+def _pick_station(task):
+    """ пикировка одной станции: (index, p, s) или (index, None, ошибка) """
+    index, slices, spr, params = task
+    z, n, e = [_shared[first:last] for first, last in slices]
+    try:
+        p, s = arPick(z, n, e, spr, *params)
+    except Exception, e:
+        return index, None, str(e)
+    return index, p, s
+
+
+def ar_picks(stations, params, processes=None, timeout=None):
+    """
+    AR picks of stations: list of (index, (z, n, e), sampling rate).
+    Yields (index, p, s) as stations are done (in any order); p is None
+    and s the error message if picking failed. With timeout (s) None is
+    yielded when no station was done in time (to keep a GUI responsive);
+    the pool is terminated when the generator is closed.
+    """
+    total = sum(len(a) for _, arrays, _ in stations for a in arrays)
+    buf = multiprocessing.RawArray(ctypes.c_float, max(total, 1))
+    shared = np.frombuffer(buf, dtype=np.float32)
+    tasks = []
+    pos = 0
+    for index, arrays, spr in stations:
+        slices = []
+        for a in arrays:
+            shared[pos:pos + len(a)] = a
+            slices.append((pos, pos + len(a)))
+            pos += len(a)
+        tasks.append((index, slices, spr, params))
+    pool = multiprocessing.Pool(processes or None, _init_worker, (buf,))
+    try:
+        results = pool.imap_unordered(_pick_station, tasks)
+        done = 0
+        while done < len(tasks):
+            try:
+                result = results.next(timeout)
+            except multiprocessing.TimeoutError:
+                yield
+                continue
+            done += 1
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
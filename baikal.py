@@ -3,6 +3,7 @@
 """
 Описание старого формата Байкал
 """
+import os
 import struct
 import numpy as np
 import datetime
@@ -33,6 +34,45 @@ def get_time(t0, unpack=False):
         return (hours, minutes, seconds)
 
 
+# в архиве файлы с razr=24 записаны и 4-байтовыми отсчётами (int32, как
+# читалось всегда), и упакованными 3-байтовыми; по размеру файла их не
+# различить, поэтому упакованные читаются только если это включено
+PACKED24 = False
+
+
+def set_packed24(packed):
+    """ читать ли отсчёты razr=24 как упакованные 3-байтовые (по умолчанию
+    для всех файлов, у которых packed24 не задан) """
+    global PACKED24
+    PACKED24 = bool(packed)
+
+
+def decode_int24(raw):
+    """ упакованные 3-байтовые little-endian отсчёты (массив uint8) -> int32.
+    Каждый отсчёт читается как 4 байта с шагом 3 (без цикла по отсчётам),
+    лишний старший байт (начало следующего отсчёта) выбрасывается сдвигом
+    влево, а арифметический сдвиг вправо распространяет знак """
+    raw = np.ascontiguousarray(raw, dtype=np.uint8)
+    n = len(raw) // 3
+    out = np.empty(n, dtype=np.int32)
+    if not n:
+        return out
+    # все отсчёты, кроме последнего: 4-байтовые окна не выходят за буфер
+    words = np.ndarray(shape=(n - 1,), dtype="<i4", buffer=raw, strides=(3,))
+    np.left_shift(words, 8, out=out[:-1])
+    # последний отсчёт - через дополненную нулём копию 3 байт
+    last = np.zeros(4, dtype=np.uint8)
+    last[:3] = raw[3 * n - 3:3 * n]
+    out[-1:] = last.view("<i4") << 8
+    np.right_shift(out, 8, out=out)
+    return out
+
+
+def to_datetime(t):
+    """ UTCDateTime (obspy) или datetime -> datetime """
+    return getattr(t, "datetime", t)
+
+
 #=== Главный заголовок файла (120 байт)
 MainHeaderMap = (
     #name          type   start   default  end
@@ -70,6 +110,26 @@ ChannelHeaderMap = (
 #ShortMainHeaderMap = [i for i in MainHeaderMap if i[0] in
 #    ['kan', 'day', 'month', 'year', "razr", 'station', 'dt', 'to']]
 
+
+def _dtype_field(name, typ):
+    """ поле структурного dtype numpy из формата struct ("h", "6h", "16s") """
+    count, code = typ[:-1], typ[-1]
+    if code == "s":
+        return (name, "S" + count)
+    if count:
+        return (name, "<" + code, (int(count),))
+    return (name, "<" + code)
+
+# те же заголовки как структурные типы numpy
+MainHeaderDtype = np.dtype([_dtype_field(name, typ)
+    for name, typ, _, _, _ in MainHeaderMap])
+ChannelHeaderDtype = np.dtype([_dtype_field(name, typ)
+    for name, typ, _ in ChannelHeaderMap])
+
+# максимальное число каналов в файле
+MAX_KAN = 6
+
+
 #TODO: use AttribDict from obspy
 class MyDictClass(dict):
     def __init__(self, *args, **kwargs):
@@ -82,57 +142,113 @@ class MyDictClass(dict):
         return v
 
 
-class BaikalFile(object):
-    """ Полное описание файлов формата Байкал """
-    def __init__(self, filename):
+def header_dtype(nkan=MAX_KAN):
+    """ главный заголовок и nkan заголовков каналов одной записью """
+    return np.dtype([
+        ("main", MainHeaderDtype),
+        ("channels", ChannelHeaderDtype, (nkan,)),
+    ])
+
+
+def record2dict(record):
+    """ запись структурного массива -> MyDictClass (как раньше через struct) """
+    d = MyDictClass()
+    for name in record.dtype.names:
+        value = record[name].tolist()
+        # для полей вида "6h" struct.unpack(...)[0] давал первый элемент
+        if isinstance(value, list): value = value[0]
+        d[name] = stripnulls(value)
+    return d
+
+
+def read_header_stack(filenames):
+    """ прочитать заголовки множества файлов и декодировать их одним вызовом
+    np.frombuffer. Возвращает структурный массив с dtype header_dtype(),
+    у каждого файла действительны первые main.kan заголовков каналов """
+    size = header_dtype().itemsize
+    buf = bytearray()
+    for filename in filenames:
+        with open(filename, 'rb') as _f:
+            data = _f.read(size)
+        # короткие файлы дополняем нулями
+        buf += data + b"\00" * (size - len(data))
+    if not buf:
+        # np.char не работает с пустыми массивами строк
+        return np.zeros(0, dtype=header_dtype())
+    records = np.frombuffer(buf, dtype=header_dtype())
+    main = records["main"]
+    # неправильный год кое-где
+    main["year"][main["year"] < 1900] += 2000
+    # поправим станцию
+    station = main["station"]
+    for sym in ("\00", "\01", ".st"):
+        station = np.char.replace(station, sym, "")
+    main["station"] = np.char.strip(station)
+    return records
+
+
+class BaikalHeader(object):
+    """ Заголовки файла формата Байкал (без чтения области данных) """
+    # отсчёты razr=24 упакованы в 3 байта (None - как PACKED24)
+    packed24 = None
+
+    def __init__(self, filename, packed24=None):
         self.filename = filename
+        self.packed24 = packed24
         self.valid = self.is_baikal()
-        # чтение файла
+        # чтение заголовков
         if self.valid:
-            main_header, channels, data = self.read()
-            self.main_header = main_header
-            self.channels = channels
-            self.data = data
+            self.main_header, self.channels = self.read_header()
 
-    def read(self):
-        """ извлекаем информацию из файла """
-        #try:
+    def read_header(self):
+        """ читаем главный заголовок и заголовки каналов """
         with open(self.filename, 'rb') as _f:
-            # читать главный заголовок
-            data = _f.read(120)
-            main_header = MyDictClass()
-            for name, typ, start, _, end in MainHeaderMap:
-                main_header[name] = struct.unpack(typ, data[start:end])[0]
-            # поправим станцию
-            main_header["station"] = stripnulls(main_header["station"])
-            # неправильный год кое-где
-            if main_header["year"] < 1900: main_header["year"] += 2000
-            # channels headers (соотв количеству каналов в файле)
-            channels = []
-            # считать заголовки каналов
-            for _ in range(main_header.kan):
-                channel = MyDictClass()
-                for _name, _typ, _size in ChannelHeaderMap:
-                    value = struct.unpack(_typ, _f.read(_size))[0]
-                    channel[_name] = stripnulls(value)
-                channels += [channel]
-            # считать область данных
-            nkan = main_header.kan
-            razr = main_header.razr
-            # размер одного замера
-            razm = 2 if razr==16 else 4
-            # тип
-            typ = "h" if razr==16 else "i"
-            # dtype
-            dtyp = np.int16 if razr==16 else np.int32
-            a = np.fromstring(_f.read(), dtype=dtyp)
-            # обрезать массив с конца пока он не делится на 3
-            while len(a) % 3 != 0: a = a[:-1]
-            # демультиплексируем
-            data = a.reshape((len(a)/nkan, nkan)).T
-            #
-        return main_header, channels, data
-    
+            return self._read_header(_f)
+
+    def _read_header(self, _f):
+        """ читаем заголовки из открытого файла (позиция - начало файла) """
+        # главный заголовок, из него число каналов
+        data = _f.read(120)
+        nkan = int(np.frombuffer(data, dtype=MainHeaderDtype)["kan"][0])
+        # channels headers (соотв количеству каналов в файле)
+        data += _f.read(72 * nkan)
+        # разобрать все заголовки одним вызовом
+        record = np.frombuffer(data, dtype=header_dtype(nkan))[0]
+        main_header = record2dict(record["main"])
+        # неправильный год кое-где
+        if main_header["year"] < 1900: main_header["year"] += 2000
+        channels = [record2dict(channel) for channel in record["channels"]]
+        return main_header, channels
+
+    @property
+    def data_offset(self):
+        """ начало области данных - сразу за заголовками каналов """
+        return 120 + 72 * self.main_header.kan
+
+    @property
+    def dtype(self):
+        """ тип одного замера (после декодирования) """
+        return np.dtype(np.int16 if self.main_header.razr==16 else np.int32)
+
+    @property
+    def sample_size(self):
+        """ размер одного замера в файле, байт (24 бита - упакованы в 3,
+        только если это включено: packed24 файла или PACKED24) """
+        if self.main_header.razr == 24:
+            packed = PACKED24 if self.packed24 is None else self.packed24
+            if packed: return 3
+        return self.dtype.itemsize
+
+    @property
+    def nframes(self):
+        """ число целых кадров (по одному замеру на каждый канал) по размеру
+        файла, неполный кадр в конце файла отбрасываем """
+        size = os.path.getsize(self.filename) - self.data_offset
+        return max(size, 0) // (self.sample_size * self.main_header.kan)
+
+    # число отсчётов в каждом канале
+    npts = nframes
+
     def is_baikal(self):
         """ является ли файлом формата Байкал """
         # проверка вдруг текстовый файл
@@ -159,3 +275,129 @@ class BaikalFile(object):
         time = get_time(self.main_header.to)
         #
         return datetime.datetime.combine(date, time)
+
+    def get_starttime(self):
+        """ дата/время первого прочитанного отсчёта """
+        seconds = getattr(self, "first_frame", 0) * self.main_header.dt
+        return self.get_datetime() + datetime.timedelta(seconds=seconds)
+
+    def get_endtime(self):
+        """ дата/время последнего прочитанного отсчёта (без данных - файла) """
+        data = getattr(self, "data", None)
+        if data is not None:
+            last = getattr(self, "first_frame", 0) + data.shape[1]
+        else:
+            last = self.npts
+        seconds = max(last - 1, 0) * self.main_header.dt
+        return self.get_datetime() + datetime.timedelta(seconds=seconds)
+
+    def frame_range(self, starttime=None, endtime=None):
+        """ номер первого кадра и следующего за последним в окне времени
+        [starttime, endtime] (datetime или UTCDateTime, None - край файла) """
+        nframes = self.nframes
+        t0 = self.get_datetime()
+        dt = self.main_header.dt
+        first, last = 0, nframes
+        if starttime is not None:
+            seconds = (to_datetime(starttime) - t0).total_seconds()
+            first = int(math.ceil(seconds / dt - 1e-6))
+        if endtime is not None:
+            seconds = (to_datetime(endtime) - t0).total_seconds()
+            last = int(math.floor(seconds / dt + 1e-6)) + 1
+        first = min(max(first, 0), nframes)
+        last = min(max(last, first), nframes)
+        return first, last
+
+    def iter_blocks(self, nframes, starttime=None, endtime=None):
+        """ читать файл последовательно по nframes кадров, выдавая пары
+        (время начала блока, массив (kan, nframes)); в памяти всегда только
+        один блок, последний блок может быть короче """
+        nkan = self.main_header.kan
+        dt = self.main_header.dt
+        t0 = self.get_datetime()
+        first, last = self.frame_range(starttime, endtime)
+        with open(self.filename, 'rb') as _f:
+            _f.seek(self.data_offset + first * nkan * self.sample_size)
+            for start in xrange(first, last, nframes):
+                count = min(nframes, last - start)
+                a = self._read_samples(_f, count * nkan)
+                # файл мог укоротиться во время чтения
+                count = len(a) // nkan
+                if not count:
+                    return
+                # демультиплексируем
+                block = a[:count * nkan].reshape((count, nkan)).T
+                yield t0 + datetime.timedelta(seconds=start * dt), block
+
+    def _read_samples(self, _f, count):
+        """ прочитать count замеров с текущей позиции файла """
+        if self.sample_size == 3:
+            return decode_int24(np.fromfile(_f, dtype=np.uint8, count=3 * count))
+        return np.fromfile(_f, dtype=self.dtype, count=count)
+
+
+class BaikalFile(BaikalHeader):
+    """ Полное описание файлов формата Байкал """
+    def __init__(self, filename, mmap=False, starttime=None, endtime=None,
+                 packed24=None):
+        # mmap=True - не читать данные, а отображать их в память (np.memmap)
+        self.mmap = mmap
+        self.filename = filename
+        self.packed24 = packed24
+        # номер первого прочитанного кадра (при чтении окна по времени)
+        self.first_frame = 0
+        self.valid = self.is_baikal()
+        # чтение файла
+        if self.valid:
+            main_header, channels, data = self.read(starttime, endtime)
+            self.main_header = main_header
+            self.channels = channels
+            self.data = data
+
+    def read(self, starttime=None, endtime=None):
+        """ извлекаем информацию из файла; если задано окно времени - читаем
+        только попадающие в него кадры """
+        #try:
+        with open(self.filename, 'rb') as _f:
+            main_header, channels = self._read_header(_f)
+            self.main_header = main_header
+            # считать область данных
+            nkan = main_header.kan
+            dtyp = self.dtype
+            first, last = self.frame_range(starttime, endtime)
+            self.first_frame = first
+            # смещение первого нужного кадра от начала файла
+            offset = self.data_offset + first * nkan * self.sample_size
+            nframes = last - first
+            if not nframes:
+                a = np.zeros((0, nkan), dtype=dtyp)
+            elif self.mmap and self.sample_size == 3:
+                # 3-байтовые отсчёты отобразить как int32 нельзя -
+                # декодируем прямо из отображения файла
+                raw = np.memmap(self.filename, dtype=np.uint8, mode="r",
+                    offset=offset, shape=(3 * nframes * nkan,))
+                a = decode_int24(raw).reshape((nframes, nkan))
+            elif self.mmap:
+                # без копирования: режим "c" (copy-on-write) - страницы
+                # копируются в память только при записи в массив
+                a = np.memmap(self.filename, dtype=dtyp, mode="c",
+                    offset=offset, shape=(nframes, nkan))
+            else:
+                _f.seek(offset)
+                a = self._read_samples(_f, nframes * nkan)
+                a = a.reshape((nframes, nkan))
+            # демультиплексируем (каждый канал - strided view, без копии)
+            data = a.T
+            #
+        return main_header, channels, data
+
+
+def iter_baikal_headers(path):
+    """ обойти папку (например DATA_DIR) и вернуть заголовки всех файлов
+    формата Байкал, не читая области данных """
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for fname in sorted(files):
+            header = BaikalHeader(os.path.join(root, fname))
+            if header.valid:
+                yield header
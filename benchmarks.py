@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Замеры скорости (benchmarks).
+
+    python benchmarks.py
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+from baikal import BaikalFile, header_dtype, decode_int24
+from trigger import trigger_arrays
+
+
+def timeit(func, repeat=5):
+    """ лучшее время (с) из repeat запусков функции """
+    best = None
+    for _ in range(repeat):
+        t = time.time()
+        func()
+        t = time.time() - t
+        if best is None or t < best: best = t
+    return best
+
+
+def make_baikal_file(filename, razr, nframes, nkan=3):
+    """ записать файл формата Байкал со случайными отсчётами """
+    header = np.zeros(1, dtype=header_dtype(nkan))
+    main = header["main"]
+    main["kan"], main["razr"], main["vers"] = nkan, razr, 53
+    main["year"], main["month"], main["day"] = 2013, 1, 1
+    main["station"] = "test"
+    main["dt"] = 0.01
+    header["channels"]["name_chan"] = list("ZNE" * 2)[:nkan]
+    a = np.random.randint(-2**15, 2**15, size=nframes * nkan)
+    if razr == 16:
+        raw = a.astype("<i2").tostring()
+    elif razr == 24:
+        raw = a.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3].tostring()
+    else:
+        raw = a.astype("<i4").tostring()
+    with open(filename, "wb") as _f:
+        _f.write(header.tostring())
+        _f.write(raw)
+
+
+def bench_baikal_decoding(nframes=10**6, nkan=3):
+    """ скорость чтения файлов Байкал с отсчётами 16, 24 (упакованные)
+    и 32 бита; скорость считается по числу отсчётов в секунду """
+    print("Baikal decoding, %d frames x %d channels:" % (nframes, nkan))
+    nsamples = nframes * nkan
+    for razr in (16, 24, 32):
+        fd, filename = tempfile.mkstemp(suffix=".xx")
+        os.close(fd)
+        try:
+            make_baikal_file(filename, razr, nframes, nkan)
+            t = timeit(lambda: BaikalFile(filename, packed24=True))
+            print("  razr=%d: read %8.1f Msamples/s  (%.3f s)" % (razr,
+                nsamples / t / 1e6, t))
+        finally:
+            os.remove(filename)
+    # только декодирование 24 бит (без чтения файла)
+    raw = np.random.randint(0, 256, size=3 * nsamples).astype(np.uint8)
+    t = timeit(lambda: decode_int24(raw))
+    print("  decode_int24 only: %8.1f Msamples/s  (%.3f s)" % (nsamples / t / 1e6, t))
+
+
+def bench_sta_lta(nchannels=150, npts=60000, df=100., sta=0.5, lta=10.):
+    """ STA/LTA для сети станций: все каналы одним массивом (trigger.py)
+    против копирования потока и obspy по трассам """
+    print("STA/LTA, %d channels x %d samples:" % (nchannels, npts))
+    nsamples = nchannels * npts
+    arrays = list(np.random.randn(nchannels, npts).astype(np.float32))
+    for method in ("recstalta", "classicstalta"):
+        t = timeit(lambda: trigger_arrays(arrays, df, sta, lta, method),
+                   repeat=3)
+        print("  %s multi-channel: %8.1f Msamples/s  (%.3f s)" % (method,
+            nsamples / t / 1e6, t))
+    try:
+        from obspy.core import Stream, Trace
+    except ImportError:
+        print("  obspy not available, per-trace path skipped")
+        return
+    st = Stream([Trace(a, header={"sampling_rate": df}) for a in arrays])
+    for method in ("recstalta", "classicstalta"):
+        t = timeit(lambda: st.copy().trigger(method, sta=sta, lta=lta),
+                   repeat=3)
+        print("  %s obspy per trace: %8.1f Msamples/s  (%.3f s)" % (method,
+            nsamples / t / 1e6, t))
+
+
+BENCHMARKS = (
+    bench_baikal_decoding,
+    bench_sta_lta,
+)
+
+
+def main():
+    names = sys.argv[1:]
+    for bench in BENCHMARKS:
+        if not names or bench.__name__ in names:
+            bench()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,11 @@ APP_NAME = 'cleanpyck'
 
 import os
 import sys
+import time
 import argparse
 import copy
 import datetime
+from multiprocessing.pool import ThreadPool
 
 from PyQt4 import QtGui, QtCore
 from PyQt4.QtCore import QEvent, Qt
@@ -32,6 +34,7 @@ with warnings.catch_warnings(record=True) as w:
 from qt_design_short import Ui_qMainWindow_obsPyck
 
 from util import *
+from archive_index import ArchiveIndex
 
 
 class ObsPyck(QtGui.QMainWindow):
@@ -118,8 +121,11 @@ class ObsPyck(QtGui.QMainWindow):
         self.stPt = 0
         #
         self.drawAxes()
+        # pick lines, labels and the cursor are blitted over the waveforms
+        self.overlay = PickOverlay(self.canv)
         self.multicursor = MultiCursor(self.canv, self.axs, useblit=True,
-            color='k', linewidth=1, ls='dotted')
+            overlay=self.overlay, motion=False, color='k', linewidth=1,
+            ls='dotted')
         # Initialize the stream related widgets with the right values:
         self.widgets.qComboBox_streamName.clear()
         labels = ["%s.%s" % (st[0].stats.network, st[0].stats.station) \
@@ -143,9 +149,13 @@ class ObsPyck(QtGui.QMainWindow):
         # The scroll event is handled using Qt.
         #self.canv.mpl_connect('scroll_event', self.__mpl_wheelEvent)
         self.canv.mpl_connect('button_press_event', self.__mpl_mouseButtonPressEvent)
-        self.canv.mpl_connect('motion_notify_event', self.__mpl_motionNotifyEvent)
+        # envelopes depend on the axes width (window shown, maximized, resized)
+        self.canv.mpl_connect('resize_event', self.__mpl_resizeEvent)
+        # mouse motion (labels and cursor) is handled once per display frame
+        self.motion = MotionCoalescer(self.canv, self.__mpl_motionNotifyEvent)
         self.multicursorReinit()
         self.canv.show()
+        self.prefetchAdjacent()
         self.showMaximized()
         # XXX XXX the good old focus issue again!?! no events get to the mpl canvas
         # XXX self.canv.setFocusPolicy(Qt.WheelFocus)
@@ -185,6 +195,14 @@ class ObsPyck(QtGui.QMainWindow):
         #Define a pointer to navigate through the streams
         self.stNum = len(streams)
         self.stPt = 0
+        # next/previous streams prepared for display in background
+        if hasattr(self, "prefetcher"):
+            self.prefetcher.invalidate()
+        else:
+            self.prefetcher = StreamPrefetcher(self.prepareStream)
+        # axes (with lines and transforms) not shown at the moment, by
+        # number of components, to be reused for other streams
+        self.axesPool = {}
         #
         self.dictOrigin = {}
         self.dictMagnitude = {}
@@ -200,7 +218,10 @@ class ObsPyck(QtGui.QMainWindow):
         filename = QtGui.QFileDialog.getOpenFileName(self, 'Open file',
             '/home/Work/seis')
         print filename
-        stream = read(str(filename))
+        traces = get_traces_from_baikal_file(str(filename))
+        if traces is None:
+            return
+        stream = Stream(traces=traces)
         self.load_data(self.dicts, [stream], self.options, self.keys, redraw=True)
 
     def ok_save(self):
@@ -215,7 +236,7 @@ class ObsPyck(QtGui.QMainWindow):
         print("cancel changes...")
         self.dicts = copy.deepcopy(self.dicts_original)
         self.updateAllItems()
-        self.redraw()
+        self.redrawPicks()
 
     #===
 
@@ -250,15 +271,21 @@ class ObsPyck(QtGui.QMainWindow):
                 widget = getattr(self.widgets, name)
                 widget.setEnabled(not state)
         if state:
-            self.delAxes()
+            start = time.time()
+            self.delAllItems()
+            self.stashAxes()
             self.fig.clear()
             self.drawStreamOverview()
             self.multicursor.visible = False
             self.canv.draw()
+            if self.options.debug:
+                print "Overview of %d streams: %.0f ms" % (self.stNum,
+                    (time.time() - start) * 1000)
         else:
             self.delAxes()
             self.fig.clear()
-            self.drawAxes()
+            if not self.restoreAxes():
+                self.drawAxes()
             self.drawAllItems()
             self.multicursorReinit()
             self.updatePlot()
@@ -276,7 +303,7 @@ class ObsPyck(QtGui.QMainWindow):
             return
         self.clearDictionaries()
         self.updateAllItems()
-        self.redraw()
+        self.redrawPicks()
 
 
     def on_qToolButton_debug_clicked(self, *args):
@@ -294,18 +321,26 @@ class ObsPyck(QtGui.QMainWindow):
         self.widgets.qComboBox_streamName.setCurrentIndex(self.stPt)
 
     def on_qComboBox_streamName_currentIndexChanged(self, newvalue):
+        start = time.time()
         self.stPt = self.widgets.qComboBox_streamName.currentIndex()
         xmin, xmax = self.axs[0].get_xlim()
         self.delAllItems()
-        self.delAxes()
-        self.fig.clear()
-        self.drawAxes()
+        if len(self.axs) == len(self.streams[self.stPt]):
+            # same number of components: only swap the data
+            self.setStreamData()
+        else:
+            self.stashAxes()
+            self.fig.clear()
+            if not self.restoreAxes():
+                self.drawAxes()
+            self.multicursorReinit()
         self.drawAllItems()
-        self.multicursorReinit()
         self.axs[0].set_xlim(xmin, xmax)
         self.updatePlot()
         stats = self.streams[self.stPt][0].stats
         print "Going to stream: %s.%s" % (stats.network, stats.station)
+        if self.options.debug:
+            print "Stream switch: %.0f ms" % ((time.time() - start) * 1000)
         self.updateStreamNumberLabel()
 
     def on_qToolButton_nextStream_clicked(self, *args):
@@ -319,7 +354,7 @@ class ObsPyck(QtGui.QMainWindow):
         # entries.
         try:
             self.updateMulticursorColor()
-            self.redraw()
+            self.redrawPicks()
         except AttributeError:
             pass
 
@@ -337,7 +372,7 @@ class ObsPyck(QtGui.QMainWindow):
         self.updateAllItems()
         self._arpicker()
         self.updateAllItems()
-        self.redraw()
+        self.redrawPicks()
 
 
     def debug(self):
@@ -381,9 +416,9 @@ class ObsPyck(QtGui.QMainWindow):
         ymax = PHASE_LINEHEIGHT_PERC[key]
         # draw lines and store references in dictionary
         for ax in self.axs:
-            line = ax.axvline(d[key], color=PHASE_COLORS[key],
+            line = self.overlay.add(ax.axvline(d[key], color=PHASE_COLORS[key],
                     linewidth=AXVLINEWIDTH, linestyle=PHASE_LINESTYLES[key],
-                    ymin=ymin, ymax=ymax)
+                    ymin=ymin, ymax=ymax))
             self.lines[key][ax] = line
     
     def delLine(self, key):
@@ -396,7 +431,7 @@ class ObsPyck(QtGui.QMainWindow):
         if key not in self.lines:
             return
         for ax, line in self.lines[key].iteritems():
-            ax.lines.remove(line)
+            self.overlay.remove(line)
         del self.lines[key]
 
     def updateLine(self, key):
@@ -435,9 +470,9 @@ class ObsPyck(QtGui.QMainWindow):
         ax = self.axs[0]
         # draw text and store references in dictionary
         self.texts[key] = {}
-        text = ax.text(dict[key], 1 - 0.01 * len(self.axs), '  ' + label,
-                transform=self.trans[0], color=PHASE_COLORS[key],
-                family='monospace', va="top")
+        text = self.overlay.add(ax.text(dict[key], 1 - 0.01 * len(self.axs),
+                '  ' + label, transform=self.trans[0], color=PHASE_COLORS[key],
+                family='monospace', va="top"))
         self.texts[key][ax] = text
 
     def drawSynthLabel(self, key):
@@ -453,9 +488,9 @@ class ObsPyck(QtGui.QMainWindow):
         ax = self.axs[0]
         # draw text and store references in dictionary
         self.texts[key] = {}
-        text = ax.text(dict[key], 1 - 0.03 * len(self.axs), '  ' + label,
-                transform=self.trans[0], color=PHASE_COLORS[key],
-                family='monospace', va="top")
+        text = self.overlay.add(ax.text(dict[key], 1 - 0.03 * len(self.axs),
+                '  ' + label, transform=self.trans[0], color=PHASE_COLORS[key],
+                family='monospace', va="top"))
         self.texts[key][ax] = text
     
     def delLabel(self, key):
@@ -467,7 +502,7 @@ class ObsPyck(QtGui.QMainWindow):
         if key not in self.texts:
             return
         for ax, text in self.texts[key].iteritems():
-            ax.texts.remove(text)
+            self.overlay.remove(text)
         del self.texts[key]
 
     def updateLabel(self, key):
@@ -532,10 +567,11 @@ class ObsPyck(QtGui.QMainWindow):
         ylims = list(ax.get_ylim())
         keyT = key + "T"
         self.lines[key] = {}
-        line = ax.plot((d[keyT],), (d[key],), markersize=MAG_MARKER['size'],
+        line = self.overlay.add(ax.plot((d[keyT],), (d[key],),
+                markersize=MAG_MARKER['size'],
                 markeredgewidth=MAG_MARKER['edgewidth'],
                 color=PHASE_COLORS['Mag'], marker=MAG_MARKER['marker'],
-                zorder=2000)[0]
+                zorder=2000)[0])
         self.lines[key][ax] = line
         ax.set_xlim(xlims)
         ax.set_ylim(ylims)
@@ -572,6 +608,8 @@ class ObsPyck(QtGui.QMainWindow):
         self.trans = trans
         t = []
         self.t = t
+        plotdata = []
+        self.plotdata = plotdata
         for i, tr in enumerate(st):
             if i == 0:
                 ax = fig.add_subplot(len(st), 1, 1)
@@ -580,21 +618,14 @@ class ObsPyck(QtGui.QMainWindow):
                 ax.xaxis.set_ticks_position("top")
             axs.append(ax) 
             # relative x-axis times start with 0 at global reference time
-            starttime_relative = self.time_abs2rel(tr.stats.starttime)
-            sampletimes = np.arange(starttime_relative,
-                    starttime_relative + (tr.stats.delta * tr.stats.npts),
-                    tr.stats.delta)
-            # XXX sometimes our arange is one item too long (why??), so we just cut
-            # off the last item if this is the case
-            if len(sampletimes) == tr.stats.npts + 1:
-                sampletimes = sampletimes[:-1]
-            t.append(sampletimes)
+            t.append(TimeAxis.from_trace(tr, self.T0))
             trans.append(matplotlib.transforms.blended_transform_factory(ax.transData,
                                                                          ax.transAxes))
             ax.xaxis.set_major_formatter(FuncFormatter(formatXTicklabels))
             # normalize with overall sensitivity and convert to nm/s
             # if not explicitly deactivated on command line
-            plts.append(ax.plot(sampletimes, tr.data, color='k', zorder=1000)[0])
+            plotdata.append(tr.data)
+            plts.append(ax.plot(*self.lodData(i), color='k', zorder=1000)[0])
             textcolor = "blue"
         self.drawIds()
         axs[-1].xaxis.set_ticks_position("both")
@@ -605,6 +636,50 @@ class ObsPyck(QtGui.QMainWindow):
         self.yMin, self.yMax = axs[0].get_ylim()
         fig.subplots_adjust(bottom=0.001, hspace=0.000, right=0.999, top=0.999, left=0.001)
     
+    def setStreamData(self):
+        """
+        Put the current stream into the axes shown (same number of
+        components): swap time axes, data and ids, reset the zoom limits.
+        """
+        st = self.streams[self.stPt]
+        self.t = [TimeAxis.from_trace(tr, self.T0) for tr in st]
+        self.plotdata = [tr.data for tr in st]
+        self.updateIds("blue")
+        # limits showing the whole stream (as autoscaling in drawAxes)
+        ax = self.axs[0]
+        xmin = min(t.start for t in self.t)
+        xmax = max(t.end for t in self.t)
+        ymin = min(data.min() for data in self.plotdata if len(data))
+        ymax = max(data.max() for data in self.plotdata if len(data))
+        self.xMin, self.xMax = ax.xaxis.get_major_locator().view_limits(xmin, xmax)
+        self.yMin, self.yMax = ax.yaxis.get_major_locator().view_limits(ymin, ymax)
+        ax.set_ylim(self.yMin, self.yMax)
+
+    def stashAxes(self):
+        """
+        Remove the stream axes from the figure, keeping them (with lines and
+        transforms) in the pool for streams with the same number of
+        components.
+        """
+        self.axesPool[len(self.axs)] = (self.axs, self.plts, self.trans)
+        self.delAxes()
+
+    def restoreAxes(self):
+        """
+        Show the current stream in axes from the pool.
+        Returns False if there are none for its number of components.
+        """
+        key = len(self.streams[self.stPt])
+        if key not in self.axesPool:
+            return False
+        self.axs, self.plts, self.trans = self.axesPool.pop(key)
+        for ax in self.axs:
+            self.fig.add_axes(ax)
+        if self.supTit not in self.fig.texts:
+            self.fig.texts.append(self.supTit)
+        self.setStreamData()
+        return True
+
     def delAxes(self):
         for ax in self.axs:
             if ax in self.fig.axes: 
@@ -617,24 +692,102 @@ class ObsPyck(QtGui.QMainWindow):
         for line in self.multicursor.lines:
             line.set_visible(False)
         self.canv.draw()
+
+    def redrawPicks(self):
+        """
+        Redraw only pick lines, labels and the cursor over the cached
+        waveforms (blitting instead of a full canvas draw).
+        """
+        self.overlay.update()
+
+    def lodData(self, i, xmin=None, xmax=None):
+        """
+        Times and values to plot for trace i in x-range [xmin, xmax] (whole
+        trace by default): min/max pairs per pixel column of the axes, raw
+        samples when zoomed in far enough.
+        """
+        t = self.t[i]
+        if xmin is None:
+            xmin, xmax = t.start, t.end
+        # ширина, под которую построены огибающие (см. __mpl_resizeEvent)
+        self.lodWidth = self.axs[i].bbox.width
+        return minmax_envelope(self.plotdata[i], t.start, t.delta, xmin, xmax,
+                               self.lodWidth)
+
+    def updateLOD(self):
+        """
+        Recompute the plotted traces for the current x-range (call after
+        zooming or changing the plotted data).
+        """
+        if self.widgets.qToolButton_overview.isChecked():
+            self.updateOverviewLOD()
+            return
+        xmin, xmax = self.axs[0].get_xlim()
+        for i, plot in enumerate(self.plts):
+            plot.set_data(*self.lodData(i, xmin, xmax))
     
     def updatePlot(self):
         """
-        Update plot either with raw data or filter data and use filtered data.
-        Depending on status of "Filter" Button. Also check "Rotate" buttons if
-        data should be rotated to LQT or ZRT coordinates.
+        Update plot with the data of the current stream (prepared in
+        background if possible, see prefetchAdjacent).
         """
-        # XXX copying is only necessary if "Filter" or "Rotate" is selected
-        # XXX it is simpler for teh code to just copy in any case..
-        st = self.streams[self.stPt].copy()
-        d = self.dicts[self.stPt]
+        settings = self.displaySettings()
+        prepared = self.prefetcher.get(self.stPt, settings)
+        if prepared is None:
+            prepared = self.prepareStream(self.stPt, settings)
         self.updateIds("blue")
+        self.showPrepared(prepared)
         self.redraw()
-            
-        # Update all plots' y data
-        for tr, plot in zip(st, self.plts):
-            plot.set_ydata(tr.data)
-        self.redraw()
+        self.prefetchAdjacent()
+
+    def displaySettings(self):
+        """
+        Settings the displayed data depends on (see prepareStream).
+        """
+        return ()
+
+    def prepareStream(self, index, settings, xlim=None, ncols=None):
+        """
+        Data of stream index ready for display: (time axes, data arrays,
+        (xlim, ncols, envelopes for x-range xlim) or None).
+        Runs in the prefetch thread too, so must not touch the GUI.
+        """
+        st = self.streams[index]
+        t = [TimeAxis.from_trace(tr, self.T0) for tr in st]
+        data = [tr.data for tr in st]
+        lod = None
+        if xlim is not None:
+            lod = (xlim, ncols, [minmax_envelope(d, ta.start, ta.delta,
+                xlim[0], xlim[1], ncols) for ta, d in zip(t, data)])
+        return t, data, lod
+
+    def showPrepared(self, prepared):
+        """
+        Put stream data prepared by prepareStream into the plots.
+        """
+        t, data, lod = prepared
+        self.t = list(t)
+        self.plotdata = list(data)
+        xlim = tuple(self.axs[0].get_xlim())
+        if lod is not None and lod[0] == xlim and \
+           lod[1] == self.axs[0].bbox.width:
+            for plot, xy in zip(self.plts, lod[2]):
+                plot.set_data(*xy)
+        else:
+            self.updateLOD()
+
+    def prefetchAdjacent(self):
+        """
+        Prepare the next and the previous stream in background with the
+        current display settings and x-range.
+        """
+        if self.stNum < 2 or self.widgets.qToolButton_overview.isChecked():
+            return
+        settings = self.displaySettings()
+        xlim = tuple(self.axs[0].get_xlim())
+        ncols = self.axs[0].bbox.width
+        for index in ((self.stPt + 1) % self.stNum, (self.stPt - 1) % self.stNum):
+            self.prefetcher.request(index, settings, xlim, ncols)
 
     # Define the event that handles the setting of P- and S-wave picks
     # XXX prefix with underscores to avoid autoconnect to Qt
@@ -655,22 +808,19 @@ class ObsPyck(QtGui.QMainWindow):
             # some keyPress events only make sense inside our matplotlib axes
             if ev.inaxes not in self.axs:
                 return
-            # get the correct sample times array for the click
+            # no picking in the overview
+            if self.widgets.qToolButton_overview.isChecked():
+                return
+            # get the correct time axis for the click
             t = self.t[self.axs.index(ev.inaxes)]
-            # We want to round from the picking location to
-            # the time value of the nearest sample:
             samp_rate = st[0].stats.sampling_rate
-            pickSample = (ev.xdata - t[0]) * samp_rate
-            print pickSample
-            pickSample = round(pickSample)
-            print pickSample
             # we need the position of the cursor location
-            # in the seismogram array:
-            xpos = pickSample
+            # in the seismogram array (the nearest sample):
+            xpos = t.index(ev.xdata)
             # Determine the time of the nearest sample
-            pickSample = t[pickSample]
+            pickSample = t[xpos]
             print pickSample
-            print ev.inaxes.lines[0].get_ydata()[xpos]
+            print self.plotdata[self.axs.index(ev.inaxes)][xpos]
 
         if ev.key == keys['setPick']:
             # some keyPress events only make sense inside our matplotlib axes
@@ -693,7 +843,7 @@ class ObsPyck(QtGui.QMainWindow):
                 if key2 in dict and dict[phase_type] > dict[key2]:
                     self.delLine(key2)
                     self.delKey(key2)
-                self.redraw()
+                self.redrawPicks()
                 abs_time = self.time_rel2abs(dict[phase_type])
                 print "%s set at %.3f (%s)" % (KEY_FULLNAMES[phase_type],
                     dict[phase_type], abs_time.isoformat())
@@ -706,7 +856,7 @@ class ObsPyck(QtGui.QMainWindow):
                 key = phase_type + "Weight"
                 dict[key] = keys['setWeight'][ev.key]
                 self.updateLabel(phase_type)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set to %i" % (KEY_FULLNAMES[key], dict[key])
                 return
 
@@ -728,7 +878,7 @@ class ObsPyck(QtGui.QMainWindow):
                               "over R or T axes."
                         print >> sys.stderr, err
                 self.updateLabel(phase_type)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set to %s" % (KEY_FULLNAMES[key], dict[key])
                 return
 
@@ -739,7 +889,7 @@ class ObsPyck(QtGui.QMainWindow):
                 key = phase_type + "Onset"
                 dict[key] = keys['setOnset'][ev.key]
                 self.updateLabel(phase_type)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set to %s" % (KEY_FULLNAMES[key], dict[key])
                 return
 
@@ -752,7 +902,7 @@ class ObsPyck(QtGui.QMainWindow):
                 for key in depending_keys:
                     self.delKey(key)
                 self.delLabel(phase_type)
-                self.redraw()
+                self.redrawPicks()
                 return
 
         if ev.key == keys['setPickError']:
@@ -769,7 +919,7 @@ class ObsPyck(QtGui.QMainWindow):
                     key = phase_type + 'Err2'
                 dict[key] = pickSample
                 self.updateLine(key)
-                self.redraw()
+                self.redrawPicks()
                 abs_time = self.time_rel2abs(dict[key])
                 print "%s set at %.3f (%s)" % (KEY_FULLNAMES[key],
                                                dict[key], abs_time.isoformat())
@@ -797,7 +947,7 @@ class ObsPyck(QtGui.QMainWindow):
                 keyT = key + 'T'
                 keyT_other = key_other + 'T'
                 # do the actual work
-                ydata = ev.inaxes.lines[0].get_ydata() #get the first line hoping that it is the seismogram!
+                ydata = self.plotdata[self.axs.index(ev.inaxes)] # plotted lines are decimated, use the data
                 cutoffSamples = xpos - MAG_PICKWINDOW #remember, how much samples there are before our small window! We have to add this number for our MagMinT estimation!
                 dict[key] = np.min(ydata[xpos-MAG_PICKWINDOW:xpos+MAG_PICKWINDOW])
                 # special handling for GSE2 data: apply calibration
@@ -813,7 +963,7 @@ class ObsPyck(QtGui.QMainWindow):
                     self.delKey(key_other)
                     self.delKey(keyT_other)
                 self.updateMagMarker(key)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set: %s at %.3f" % (KEY_FULLNAMES[key], dict[key],
                                               dict[keyT])
                 return
@@ -840,7 +990,7 @@ class ObsPyck(QtGui.QMainWindow):
                 keyT = key + 'T'
                 keyT_other = key_other + 'T'
                 # do the actual work
-                ydata = ev.inaxes.lines[0].get_ydata() #get the first line hoping that it is the seismogram!
+                ydata = self.plotdata[self.axs.index(ev.inaxes)] # plotted lines are decimated, use the data
                 cutoffSamples = xpos - MAG_PICKWINDOW #remember, how much samples there are before our small window! We have to add this number for our MagMaxT estimation!
                 dict[key] = np.max(ydata[xpos-MAG_PICKWINDOW:xpos+MAG_PICKWINDOW])
                 # special handling for GSE2 data: apply calibration
@@ -856,7 +1006,7 @@ class ObsPyck(QtGui.QMainWindow):
                     self.delKey(key_other)
                     self.delKey(keyT_other)
                 self.updateMagMarker(key)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set: %s at %.3f" % (KEY_FULLNAMES[key], dict[key],
                                               dict[keyT])
                 return
@@ -873,7 +1023,7 @@ class ObsPyck(QtGui.QMainWindow):
                         self.delKey(key)
                 else:
                     return
-                self.redraw()
+                self.redrawPicks()
                 return
         #######################################################################
         # End of key events related to picking                                #
@@ -892,12 +1042,18 @@ class ObsPyck(QtGui.QMainWindow):
             
         if ev.key == keys['prevStream']:
             if self.widgets.qToolButton_overview.isChecked():
+                # scroll the overview by a page
+                self.scrollOverview(-self.overviewRows)
+                self.redraw()
                 return
             self.on_qToolButton_previousStream_clicked()
             return
 
         if ev.key == keys['nextStream']:
             if self.widgets.qToolButton_overview.isChecked():
+                # scroll the overview by a page
+                self.scrollOverview(self.overviewRows)
+                self.redraw()
                 return
             self.on_qToolButton_nextStream_clicked()
             return
@@ -917,6 +1073,12 @@ class ObsPyck(QtGui.QMainWindow):
         #    ax = self.axEventMap
         #else:
         ax = self.axs[0]
+        # scroll the overview rows with Ctrl+wheel
+        if self.widgets.qToolButton_overview.isChecked() and \
+           ev.modifiers() == QtCore.Qt.ControlModifier:
+            self.scrollOverview(3 if ev.delta() < 0 else -3)
+            self.redraw()
+            return
         (left, right) = ax.get_xbound()
         (bottom, top) = ax.get_ybound()
         # Get the keyboard modifiers. They are a enum type.
@@ -949,8 +1111,16 @@ class ObsPyck(QtGui.QMainWindow):
                 bottom /= 2
         ax.set_xbound(lower=left, upper=right)
         ax.set_ybound(lower=bottom, upper=top)
+        self.updateLOD()
         self.redraw()
     
+    def __mpl_resizeEvent(self, ev):
+        # огибающие построены под прежнюю ширину осей - пересчитать
+        # (в обзоре ширина тоже запоминается - см. updateOverviewLOD)
+        if not self.axs or self.axs[0].bbox.width == self.lodWidth:
+            return
+        self.updateLOD()
+
     # Define zoom reset for the mouse button 2 (always wheel wheel!?)
     def __mpl_mouseButtonPressEvent(self, ev):
         # set widgetlock when pressing mouse buttons and dont show cursor
@@ -980,6 +1150,7 @@ class ObsPyck(QtGui.QMainWindow):
             ax.set_xbound(lower=self.xMin, upper=self.xMax)
             ax.set_ybound(lower=self.yMin, upper=self.yMax)
             # Update all subplots
+            self.updateLOD()
             self.redraw()
             print "Resetting axes"
     
@@ -990,6 +1161,8 @@ class ObsPyck(QtGui.QMainWindow):
             # XXX self.canv.widgetlock.release(self.toolbar)
 
     def __mpl_motionNotifyEvent(self, ev):
+        # called with the latest event once per frame (see MotionCoalescer):
+        # update position labels and blit the cursor in all axes at once
         try:
             if ev.inaxes in self.axs:
                 self.widgets.qLabel_xdata_rel.setText(formatXTicklabels(ev.xdata))
@@ -1002,12 +1175,13 @@ class ObsPyck(QtGui.QMainWindow):
                 self.widgets.qLabel_ydata.setText(str(ev.ydata))
         except TypeError:
             pass
+        self.multicursor.onmove(ev)
     
     #lookup multicursor source: http://matplotlib.sourcearchive.com/documentation/0.98.1/widgets_8py-source.html
     def multicursorReinit(self):
-        self.canv.mpl_disconnect(self.multicursor.id1)
-        self.canv.mpl_disconnect(self.multicursor.id2)
+        self.multicursor.disconnect()
         self.multicursor.__init__(self.canv, self.axs, useblit=True,
+                                  overlay=self.overlay, motion=False,
                                   color='black', linewidth=1, ls='dotted')
         self.updateMulticursorColor()
         # XXX self.canv.widgetlock.release(self.toolbar)
@@ -1038,46 +1212,95 @@ class ObsPyck(QtGui.QMainWindow):
 
 
     def drawStreamOverview(self):
-        stNum = len(self.streams)
+        self.drawOverviewTraces([st.select(component="Z")[0]
+                                 for st in self.streams])
+
+    def drawOverviewTraces(self, traces):
+        """
+        Draw traces (one per stream) as a scrollable record section in a
+        single axes: one LineCollection with every trace normalized to its
+        own row (first stream on top), trace ids as y tick labels.
+        Only the rows in view are prepared and decimated (see
+        updateOverviewLOD), so the cost depends on the number of visible
+        rows, not on the number of streams.
+        """
+        stNum = len(traces)
         fig = self.fig
-        axs = []
-        self.axs = axs
-        plts = []
-        self.plts = plts
-        trans = []
-        self.trans = trans
-        t = []
-        for i, st in enumerate(self.streams):
-            tr = st.select(component="Z")[0]
-            # make sure that the relative x-axis times start with 0 at the time
-            # specified as start time on command line
-            starttime_relative = self.time_abs2rel(tr.stats.starttime)
-            sampletimes = np.arange(starttime_relative,
-                    starttime_relative + (tr.stats.delta * tr.stats.npts),
-                    tr.stats.delta)
-            # sometimes our arange is one item too long (why??), so we just cut
-            # off the last item if this is the case
-            if len(sampletimes) == tr.stats.npts + 1:
-                sampletimes = sampletimes[:-1]
-            t.append(sampletimes)
-            if i == 0:
-                ax = fig.add_subplot(stNum, 1, i+1)
-            else:
-                ax = fig.add_subplot(stNum, 1, i+1, sharex=axs[0], sharey=axs[0])
-                ax.xaxis.set_ticks_position("top")
-            axs.append(ax)
-            trans.append(matplotlib.transforms.blended_transform_factory(ax.transData, ax.transAxes))
-            ax.xaxis.set_major_formatter(FuncFormatter(formatXTicklabels))
-            # we have to rotate first, because we have to copy the whole stream..
-            tr = tr.copy()
-            plts.append(ax.plot(sampletimes, tr.data, color='k', zorder=1000)[0])
-        self.drawIds()
-        axs[-1].xaxis.set_ticks_position("both")
-        label = self.T0.isoformat().replace("T", "  ")
-        self.supTit = fig.suptitle(label, ha="left", va="bottom", x=0.01, y=0.01)
-        self.xMin, self.xMax = axs[0].get_xlim()
-        self.yMin, self.yMax = axs[0].get_ylim()
-        fig.subplots_adjust(bottom=0.001, hspace=0.000, right=0.999, top=0.999, left=0.001)
+        ax, collection, self.supTit = setup_overview_axes(fig, self.T0)
+        self.axs = [ax]
+        self.trans = [matplotlib.transforms.blended_transform_factory(
+            ax.transData, ax.transAxes)]
+        self.overviewTraces = traces
+        # make sure that the relative x-axis times start with 0 at the time
+        # specified as start time on command line
+        self.t = [TimeAxis.from_trace(tr, self.T0) for tr in traces]
+        self.plotdata = []
+        # prepared data and envelopes of rows
+        self.overviewCache = TraceCache(max_mb=64)
+        self.overviewRows = max(1, min(self.options.overview_rows, stNum))
+        self.overviewTop = 0
+        self.plts = [collection]
+        self.xMin = min(t.start for t in self.t)
+        self.xMax = max(t.end for t in self.t)
+        ax.set_xlim(self.xMin, self.xMax)
+        self.scrollOverview(0)
+
+    def overviewRow(self, i):
+        """
+        Prepared data of row i and its scale to half the row spacing.
+        """
+        key = ("row", i)
+        row = self.overviewCache.get(key)
+        if row is None:
+            data = self.prepareOverviewTrace(self.overviewTraces[i])
+            row = (data, overview_scale(data))
+            self.overviewCache.put(key, row, data.nbytes)
+        return row
+
+    def overviewOffset(self, i):
+        # first stream on top
+        return len(self.overviewTraces) - 1 - i
+
+    def scrollOverview(self, rows):
+        """
+        Scroll the overview by rows (negative - up) and show rows in view.
+        """
+        stNum = len(self.overviewTraces)
+        top = self.overviewTop + rows
+        self.overviewTop = max(0, min(top, stNum - self.overviewRows))
+        visible = range(self.overviewTop, self.overviewTop + self.overviewRows)
+        ax = self.axs[0]
+        # only the tick labels of visible rows exist
+        set_overview_rows(ax, [self.overviewOffset(i) for i in visible],
+                          [self.overviewTraces[i].id for i in visible])
+        self.yMin = self.overviewOffset(visible[-1]) - 0.5
+        self.yMax = self.overviewOffset(visible[0]) + 0.5
+        ax.set_ylim(self.yMin, self.yMax)
+        self.updateOverviewLOD()
+
+    def updateOverviewLOD(self):
+        """
+        Recompute the overview traces in view for the current x-range.
+        """
+        ax = self.axs[0]
+        xmin, xmax = ax.get_xlim()
+        ncols = ax.bbox.width
+        self.lodWidth = ncols
+        segments = []
+        for i in range(self.overviewTop, self.overviewTop + self.overviewRows):
+            key = ("lod", i, xmin, xmax, ncols)
+            segment = self.overviewCache.get(key)
+            if segment is None:
+                data, scale = self.overviewRow(i)
+                segment = overview_segment(data, scale, self.t[i],
+                    self.overviewOffset(i), xmin, xmax, ncols)
+                self.overviewCache.put(key, segment, segment.nbytes)
+            segments.append(segment)
+        self.plts[0].set_segments(segments)
+
+    def prepareOverviewTrace(self, tr):
+        """ data of trace tr as shown in the overview """
+        return tr.data
 
     def drawEventMap(self):
         dM = self.dictMagnitude
@@ -1334,34 +1557,71 @@ def create_gui(T0, T1, dicts, streams, options, KEYS, have_to_exit=True):
     if have_to_exit:
         qApp.exec_()
 
-def setup_dicts_streams(cursor, options, value, query):
-    """ подготовим файлы, список словарей, потоки """
+def stream_from_baikal_file(filename, starttime=None, endtime=None):
+    """ поток и словарь с именем станции из файла Байкал (None - нет данных) """
+    # получить трассы из файлов Байкал
+    traces = get_traces_from_baikal_file(filename,
+        starttime=starttime, endtime=endtime)
+    if traces is None:
+        print("Could not load data from %s! No data!" % filename)
+        return
+    # создать поток (stream)
+    st = Stream(traces=traces)
+    # словари с временами вступлений по событию
+    dic = {}
+    trZ = st.select(component="Z")[0]
+    dic['MagUse'] = False#True
+    sta = trZ.stats.station.strip()
+    dic['Station'] = sta
+    return st, dic
+
+def load_streams(filenames, jobs=1, starttime=None, endtime=None):
+    """ загрузить файлы в jobs потоков; результаты (как у
+    stream_from_baikal_file) в том же порядке, что и файлы. Ошибка в
+    одном файле не прерывает загрузку остальных """
+    def load(filename):
+        try:
+            return stream_from_baikal_file(filename, starttime, endtime)
+        except Exception, msg:
+            print("Error loading file %s: %s" % (filename, msg))
+    if jobs > 1 and len(filenames) > 1:
+        # чтение файлов (в т.ч. по сети) отпускает GIL, поэтому потоки
+        pool = ThreadPool(min(jobs, len(filenames)))
+        try:
+            results = pool.map(load, filenames)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(load, filenames)
+    failed = [f for f, result in zip(filenames, results) if result is None]
+    if failed:
+        print("Failed to load %d of %d files: %s" % (len(failed),
+            len(filenames), ", ".join(failed)))
+    return results
+
+def setup_dicts_streams(cursor, options, value, query, starttime=None, endtime=None):
+    """ подготовим файлы, список словарей, потоки
+    (starttime/endtime - загружать из файлов только это окно времени) """
     # данные в любом случае загружаются из файлов
-    #files = []
     streams = []
     dicts = []
     # подготовить и выполнять запрос
     query = query.replace("1", str(options.database))
     items = execute_query(cursor, query, (value,)) or []
+    files = []
     for item in items:
         Dir, fname = item[1:3]
-        Dir = Dir[Dir.index(DATA_DIR):].replace("\\", "/")
-        filename = os.path.join(Dir, fname)
-        #files += [filename]
+        filename = db_path2filename(Dir, fname)
+        files += [filename]
         print filename, os.path.exists(filename)
-        # получить трассы из файлов Байкал
-        traces = get_traces_from_baikal_file(filename)
-        if traces is None:
-            print("Could not load data from %s! No data!" % filename)
+    # загрузить файлы (параллельно), запросы к базе - последовательно
+    results = load_streams(files, options.jobs, starttime, endtime)
+    for item, result in zip(items, results):
+        if result is None:
             continue
-        # создать поток (stream)
-        st = Stream(traces=traces)
-        # словари с временами вступлений по событию
-        dic = {}
-        trZ = st.select(component="Z")[0]
-        dic['MagUse'] = False#True
-        sta = trZ.stats.station.strip()
-        dic['Station'] = sta
+        st, dic = result
+        dic['idPrn'] = item[0]
         # получить времена вступления волн по коду idPrn
         QUERY2 = SELECT_WAVES.replace("1", str(options.database))
         waves = execute_query(cursor, QUERY2, (item[0],))
@@ -1375,6 +1635,18 @@ def setup_dicts_streams(cursor, options, value, query):
         dicts += [dic]
     return streams, dicts
 
+def setup_dicts_streams_from_files(filenames, starttime=None, endtime=None, jobs=1):
+    """ потоки и словари прямо из списка файлов, без базы данных
+    (времён вступлений волн в словарях нет) """
+    streams = []
+    dicts = []
+    for result in load_streams(filenames, jobs, starttime, endtime):
+        if result is None:
+            continue
+        st, dic = result
+        streams += [st]
+        dicts += [dic]
+    return streams, dicts
 
 def setup_times(options, streams, dicts):
     # установить глобальный T0 - наименьшее время начала файла среди потоков
@@ -1392,13 +1664,109 @@ def setup_times(options, streams, dicts):
             if d2 > T1: T1 = d2
     # рассчитать время волны в секундах вместо строки для всех словарей
     for dic in dicts:
-        for k, v in dic.iteritems():
+        for k, v in dic.items():
             if k in SEISMIC_PHASES:
                 # перевести строку в секунды относительно T0
                 # с поправкой на начальное смещение
-                dic[k] = calc_seconds_from_T0(v, T0) - options.starttime_offset
+                try:
+                    dic[k] = calc_seconds_from_T0(v, T0) - options.starttime_offset
+                except AssertionError:
+                    # вступление раньше загруженных данных (окно -w)
+                    print("%s: %s pick %s before start of data, skipped" % (
+                        dic.get('Station'), k, v))
+                    del dic[k]
     return T0, T1, dicts
 
+def autopick_events(conn, cursor, options, codes, out=None):
+    """ пикировки P и S (AR picker) событий codes (idDir) без GUI.
+    События загружаются пачками по options.batch_size, станции всех событий
+    пачки пикируются параллельно в пуле процессов. Пикировки пишутся в файл
+    out, а без него - в базу данных (одна транзакция на пачку).
+    Возвращает число записанных пикировок """
+    # obspy.signal нужен только здесь - GUI запускается и без него
+    from autopick import ar_params, ar_picks, stream_components
+    params = ar_params(options)
+    total = 0
+    for first in range(0, len(codes), options.batch_size):
+        batch = codes[first:first + options.batch_size]
+        t = time.time()
+        # (idDir, поток, словарь) для каждой пикируемой станции
+        picked = []
+        stations = []
+        for code in batch:
+            streams, dicts = setup_dicts_streams(cursor, options, code,
+                SELECT_CODES)
+            for st, dic in zip(streams, dicts):
+                arrays = stream_components(st)
+                if arrays is None:
+                    print("%s %s: no Z, N and E components, skipped" % (code,
+                        dic['Station']))
+                    continue
+                stations.append((len(picked), arrays,
+                    st[0].stats.sampling_rate))
+                picked.append((code, st, dic))
+        rows = []
+        for index, p, s in ar_picks(stations, params, options.ar_processes):
+            code, st, dic = picked[index]
+            if p is None:
+                print("%s %s: AR picker failed: %s" % (code, dic['Station'], s))
+                continue
+            # arPick возвращает секунды от начала трассы
+            start = st[0].stats.starttime
+            rows += [(code, dic['idPrn'], dic['Station'], 'P', start + p),
+                     (code, dic['idPrn'], dic['Station'], 'S', start + s)]
+        if out is not None:
+            for code, idPrn, station, phase, pick in rows:
+                out.write("%s %s %s %s %s\n" % (code, idPrn, station, phase,
+                    pick.isoformat()))
+            out.flush()
+        elif rows:
+            delete = DELETE_AUTOPICK_WAVES.replace("1", str(options.database))
+            insert = INSERT_WAVES.replace("1", str(options.database))
+            try:
+                # прежние автоматические пикировки заменяются
+                cursor.executemany(delete, [(idPrn,) for idPrn in
+                    sorted(set(row[1] for row in rows))])
+                cursor.executemany(insert, [(idPrn, AUTOPICK_WAVES[phase],
+                    pick.strftime("%H:%M:%S.%f"))
+                    for code, idPrn, station, phase, pick in rows])
+            except psycopg2.Error, msg:
+                print("An error ocured while writing picks:", msg)
+                conn.rollback()
+                continue
+            conn.commit()
+        total += len(rows)
+        print("Events %d-%d of %d: %d picks (%.1f s)" % (first + 1,
+            first + len(batch), len(codes), len(rows), time.time() - t))
+    return total
+
+def autopick_main(conn, cursor, options):
+    """ режим --autopick: коды idDir из аргументов, файла (--fromfile) или
+    за интервал дат (--date-range) """
+    if options.date_range:
+        try:
+            for date in options.date_range:
+                datetime.datetime.strptime(date, "%Y-%m-%d")
+        except ValueError, e:
+            print('Error! Specify dates in format "YYYY-mm-dd"', e)
+            return
+        query = SELECT_DIRS_BY_DATE.replace("1", str(options.database))
+        items = execute_query(cursor, query, options.date_range) or []
+        codes = [str(item[0]) for item in items]
+    elif options.arguments:
+        codes = options.arguments
+    else:
+        fromfile = options.fromfile
+        if isinstance(fromfile, list): fromfile = fromfile[0]
+        codes = [s.strip() for s in fromfile.readlines() if s.strip()]
+    print("Picking %d events" % len(codes))
+    out = open(options.picks_out, "a") if options.picks_out else None
+    try:
+        total = autopick_events(conn, cursor, options, codes, out)
+    finally:
+        if out is not None: out.close()
+    print("Written %d picks" % total)
+
 def main():
     """ execute when the program starts """
     parser = argparse.ArgumentParser()
@@ -1415,6 +1783,9 @@ def main():
         parser.add_argument(*arg, **kwargs)
     options = parser.parse_args()
     args = options.arguments
+    TRACE_CACHE.set_budget(options.cache_size)
+    set_disk_cache(options.disk_cache, options.disk_cache_size)
+    set_packed24(options.packed24)
     #print options, args, options.database
     #return
     # For keybindings option, just print them and exit.
@@ -1422,6 +1793,29 @@ def main():
         for key, value in KEYS.iteritems():
             print '%s: "%s"' % (key, value)
         return
+    #=== поиск по времени в локальном индексе архива - без базы данных
+    if options.datetime and options.index:
+        try:
+            dt = datetime.datetime.strptime(args[0], "%Y-%m-%dT%H:%M:%S")
+        except ValueError, e:
+            print('Error! Specify datetime to search in format "YYYY-mm-ddTHH:MM:SS"', e)
+            return
+        index = ArchiveIndex(options.index)
+        filenames = index.find(dt)
+        index.close()
+        starttime, endtime = None, None
+        if options.window:
+            before, after = options.window
+            starttime = UTCDateTime(dt) - before
+            endtime = UTCDateTime(dt) + after
+        streams, dicts = setup_dicts_streams_from_files(filenames,
+            starttime, endtime, options.jobs)
+        if not streams:
+            print "Nothing found"
+            return
+        T0, T1, dicts = setup_times(options, streams, dicts)
+        create_gui(T0, T1, dicts, streams, options, KEYS)
+        return
     #===
     # соединяемся с базой данных
     result = setup_db_connection()
@@ -1430,6 +1824,11 @@ def main():
         return
     else:
         conn, cursor = result
+    # автоматические пикировки без GUI
+    if options.autopick:
+        autopick_main(conn, cursor, options)
+        conn.close()
+        return
     #=== parse options
     # check wich options to use
     if options.datetime:
@@ -1450,8 +1849,15 @@ def main():
         #time = dt.time().strftime('%H:%M:%S.%f')
         # получим число секунд из времени
         #seconds = calc_seconds_from_T0(time, dt)
+        # окно времени вокруг события, если указано
+        starttime, endtime = None, None
+        if options.window:
+            before, after = options.window
+            starttime = UTCDateTime(dt) - before
+            endtime = UTCDateTime(dt) + after
         # выполним запрос по дате
-        streams, dicts = setup_dicts_streams(cursor, options, date, SEARCH_BY_DATETIME)
+        streams, dicts = setup_dicts_streams(cursor, options, date,
+            SEARCH_BY_DATETIME, starttime, endtime)
         if not streams:
             print "Nothing found"
             return
@@ -1482,7 +1888,9 @@ def main():
         print codes
         for i, code in enumerate(codes):
             # каждый раз ищем данные и открываем программу для каждого кода idDir
-            streams, dicts = setup_dicts_streams(cursor, options, code)
+            streams, dicts = setup_dicts_streams(cursor, options, code, SELECT_CODES)
+            if options.debug:
+                print(TRACE_CACHE)
             # setup dicts (adjust times in seconds)
             T0, T1, dicts = setup_times(options, streams, dicts)
             # now show gui
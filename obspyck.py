@@ -8,6 +8,7 @@ APP_NAME = 'pyck'
 
 import os
 import sys
+import time
 import shutil
 import optparse
 import warnings
@@ -35,7 +36,7 @@ try:
     from obspy.signal.util import utlLonLat, utlGeoKm
     from obspy.signal.invsim import estimateMagnitude, paz2AmpValueOfFreqResp
     from obspy.signal import rotate_ZNE_LQT, rotate_NE_RT
-    from obspy.signal import arPick
+    from autopick import ar_params, ar_picks, stream_components
     from obspy.signal.util import az2baz2az
 except ImportError:
     msg = "Unable to import obspy.signal. Locating and estimating " + \
@@ -52,9 +53,9 @@ except ImportError:
 
 from qt_design_short import Ui_qMainWindow_obsPyck
 from util import *
+from trigger import trigger_traces
 
 from db import *
-from baikal import BaikalFile, get_time
 
 
 class ObsPyck(QtGui.QMainWindow):
@@ -151,7 +152,10 @@ class ObsPyck(QtGui.QMainWindow):
         self.stPt = 0
         
         self.drawAxes()
+        # pick lines, labels and the cursor are blitted over the waveforms
+        self.overlay = PickOverlay(self.canv)
         self.multicursor = MultiCursor(self.canv, self.axs, useblit=True,
+                                       overlay=self.overlay, motion=False,
                                        color='k', linewidth=1, ls='dotted')
 
         # Initialize the stream related widgets with the right values:
@@ -184,9 +188,34 @@ class ObsPyck(QtGui.QMainWindow):
         # The scroll event is handled using Qt.
         #self.canv.mpl_connect('scroll_event', self.__mpl_wheelEvent)
         self.canv.mpl_connect('button_press_event', self.__mpl_mouseButtonPressEvent)
-        self.canv.mpl_connect('motion_notify_event', self.__mpl_motionNotifyEvent)
+        # envelopes depend on the axes width (window shown, maximized, resized)
+        self.canv.mpl_connect('resize_event', self.__mpl_resizeEvent)
+        # mouse motion (labels and cursor) is handled once per display frame
+        self.motion = MotionCoalescer(self.canv, self.__mpl_motionNotifyEvent)
+        # filter/trigger parameters from spin boxes are applied after a pause
+        # in changes, data are prepared in the prefetch thread (see
+        # schedulePlotUpdate)
+        self.plotUpdateTimer = QtCore.QTimer()
+        self.plotUpdateTimer.setSingleShot(True)
+        self.plotUpdateTimer.setInterval(200)
+        QtCore.QObject.connect(self.plotUpdateTimer, QtCore.SIGNAL("timeout()"),
+            self.startPlotUpdate)
+        self.plotPollTimer = QtCore.QTimer()
+        self.plotPollTimer.setInterval(30)
+        QtCore.QObject.connect(self.plotPollTimer, QtCore.SIGNAL("timeout()"),
+            self.checkPlotUpdate)
+        self.plotPending = None
+        # spectrogram images by axes, waiting for spectrograms (see
+        # requestSpectrogram)
+        self.specImages = {}
+        self.specPending = None
+        self.specPollTimer = QtCore.QTimer()
+        self.specPollTimer.setInterval(30)
+        QtCore.QObject.connect(self.specPollTimer, QtCore.SIGNAL("timeout()"),
+            self.checkSpectrogram)
         self.multicursorReinit()
         self.canv.show()
+        self.prefetchAdjacent()
         self.showMaximized()
         # XXX XXX the good old focus issue again!?! no events get to the mpl canvas
         # XXX self.canv.setFocusPolicy(Qt.WheelFocus)
@@ -229,6 +258,22 @@ class ObsPyck(QtGui.QMainWindow):
         #Define a pointer to navigate through the streams
         self.stNum = len(streams)
         self.stPt = 0
+        # filtered (normalized) data for display, by stream and settings
+        self.filterCache = TraceCache(options.filter_cache_size)
+        # next/previous streams prepared for display in background
+        if hasattr(self, "prefetcher"):
+            self.prefetcher.invalidate()
+        else:
+            self.prefetcher = StreamPrefetcher(self.prepareStream)
+        # spectrograms of the visible window, computed in background
+        self.spectrogramCache = TraceCache(64)
+        if hasattr(self, "spectrograms"):
+            self.spectrograms.invalidate()
+        else:
+            self.spectrograms = StreamPrefetcher(self.prepareSpectrogram, 2)
+        # axes (with lines and transforms) not shown at the moment, by
+        # number of components, to be reused for other streams
+        self.axesPool = {}
         #
         self.dictOrigin = {}
         self.dictMagnitude = {}
@@ -252,7 +297,10 @@ class ObsPyck(QtGui.QMainWindow):
         filename = QtGui.QFileDialog.getOpenFileName(self, 'Open file',
             '/home/Work/seis')
         print filename
-        stream = read(str(filename))
+        traces = get_traces_from_baikal_file(str(filename))
+        if traces is None:
+            return
+        stream = Stream(traces=traces)
         self.load_data(self.clients, [stream], self.options, self.keys, redraw=True)
 
     def time_abs2rel(self, abstime):
@@ -286,15 +334,21 @@ class ObsPyck(QtGui.QMainWindow):
                 widget = getattr(self.widgets, name)
                 widget.setEnabled(not state)
         if state:
-            self.delAxes()
+            start = time.time()
+            self.delAllItems()
+            self.stashAxes()
             self.fig.clear()
             self.drawStreamOverview()
             self.multicursor.visible = False
             self.canv.draw()
+            if self.options.debug:
+                print "Overview of %d streams: %.0f ms" % (self.stNum,
+                    (time.time() - start) * 1000)
         else:
             self.delAxes()
             self.fig.clear()
-            self.drawAxes()
+            if not self.restoreAxes():
+                self.drawAxes()
             self.drawAllItems()
             self.multicursorReinit()
             self.updatePlot()
@@ -312,7 +366,7 @@ class ObsPyck(QtGui.QMainWindow):
             return
         self.clearDictionaries()
         self.updateAllItems()
-        self.redraw()
+        self.redrawPicks()
 
     def on_qToolButton_doHyp2000_clicked(self, *args):
         """ Поиск по дате/времени в папке seisobr """
@@ -362,7 +416,9 @@ class ObsPyck(QtGui.QMainWindow):
             filename = os.path.join(path, fname)
             print filename, os.path.exists(filename)
             # получить трассы из файлов Байкал
-            traces = self.get_traces_from_baikal_file(filename)
+            traces = get_traces_from_baikal_file(filename)
+            if traces is None:
+                continue
             # создать поток (stream)
             streams += [Stream(traces=traces)]
         #=
@@ -375,42 +431,6 @@ class ObsPyck(QtGui.QMainWindow):
         self.load_data(self.clients, streams, self.options, self.keys, redraw=True)
         self.updatePlot()
     
-    def get_traces_from_baikal_file(self, filename):
-        # загружать данные из файла формата Байкал
-        bf = BaikalFile(filename)
-        if not bf.valid:
-            print("\nSkipping file %s" % filename)
-            return
-        # time
-        _hour, _minute, _seconds = get_time(bf.main_header.to, unpack=True)
-        # and UTCDateTime
-        utcdatetime = UTCDateTime(
-            bf.main_header.year,
-            bf.main_header.month,
-            bf.main_header.day,
-            int(_hour), int(_minute), _seconds,
-            # digits after point
-            precision=3
-        )
-        # все каналы (трассы) из файла
-        traces = []
-        for i, channel in enumerate(bf.channels):
-            # repair name of channel
-            ch_name = channel.name_chan[0].upper()
-            # создадим заголовок
-            header = {
-                'network': 'BR',
-                'station': bf.main_header.station,
-                'location': '',
-                'channel': ch_name,
-                'npts': len(bf.data[i]),
-                'sampling_rate': 1. / bf.main_header.dt,
-                #'mseed': {'dataquality': 'D'},
-                'starttime': utcdatetime,
-            }
-            traces += [Trace(header=header, data=bf.data[i])]
-        return traces
-
     def on_qToolButton_showFocMec_toggled(self):
         state = self.widgets.qToolButton_showFocMec.isChecked()
         widgets_leave_active = ("qToolButton_showFocMec",
@@ -570,18 +590,26 @@ class ObsPyck(QtGui.QMainWindow):
         self.widgets.qComboBox_streamName.setCurrentIndex(self.stPt)
 
     def on_qComboBox_streamName_currentIndexChanged(self, newvalue):
+        start = time.time()
         self.stPt = self.widgets.qComboBox_streamName.currentIndex()
         xmin, xmax = self.axs[0].get_xlim()
         self.delAllItems()
-        self.delAxes()
-        self.fig.clear()
-        self.drawAxes()
+        if len(self.axs) == len(self.streams[self.stPt]):
+            # same number of components: only swap the data
+            self.setStreamData()
+        else:
+            self.stashAxes()
+            self.fig.clear()
+            if not self.restoreAxes():
+                self.drawAxes()
+            self.multicursorReinit()
         self.drawAllItems()
-        self.multicursorReinit()
         self.axs[0].set_xlim(xmin, xmax)
         self.updatePlot()
         stats = self.streams[self.stPt][0].stats
         print "Going to stream: %s.%s" % (stats.network, stats.station)
+        if self.options.debug:
+            print "Stream switch: %.0f ms" % ((time.time() - start) * 1000)
         self.updateStreamNumberLabel()
 
     def on_qToolButton_nextStream_clicked(self, *args):
@@ -595,7 +623,7 @@ class ObsPyck(QtGui.QMainWindow):
         # entries.
         try:
             self.updateMulticursorColor()
-            self.redraw()
+            self.redrawPicks()
         except AttributeError:
             pass
 
@@ -614,7 +642,7 @@ class ObsPyck(QtGui.QMainWindow):
 
     def on_qToolButton_trigger_toggled(self):
         self.updatePlot()
-        ymax = max([max(abs(p.get_ydata())) for p in self.plts])
+        ymax = max([abs(data).max() for data in self.plotdata])
         if self.widgets.qToolButton_trigger.isChecked():
             ymin = 0
         else:
@@ -633,7 +661,7 @@ class ObsPyck(QtGui.QMainWindow):
         self.updateAllItems()
         self._arpicker()
         self.updateAllItems()
-        self.redraw()
+        self.redrawPicks()
         
     def on_qComboBox_filterType_currentIndexChanged(self, newvalue):
         if self.widgets.qToolButton_filter.isChecked():
@@ -661,7 +689,7 @@ class ObsPyck(QtGui.QMainWindow):
         if newvalue < minimum:
             err = "Warning: Lowpass frequency is not supported by length of trace!"
             print >> sys.stderr, err
-        self.updatePlot()
+        self.schedulePlotUpdate()
         # XXX we could use this for the combobox too!
         # reset focus to matplotlib figure
         self.canv.setFocus() # XXX needed?? # XXX do we still need this focus grabbing with QT??? XXX XXX XXX XXX
@@ -684,7 +712,7 @@ class ObsPyck(QtGui.QMainWindow):
         if newvalue > maximum:
             err = "Warning: Highpass frequency is lower than Nyquist!"
             print >> sys.stderr, err
-        self.updatePlot()
+        self.schedulePlotUpdate()
         # XXX we could use this for the combobox too!
         # reset focus to matplotlib figure
         self.canv.setFocus() # XXX needed??
@@ -695,7 +723,7 @@ class ObsPyck(QtGui.QMainWindow):
         if not widgets.qToolButton_trigger.isChecked():
             self.canv.setFocus() # XXX needed??
             return
-        self.updatePlot()
+        self.schedulePlotUpdate()
         # reset focus to matplotlib figure
         self.canv.setFocus() # XXX needed?? # XXX do we still need this focus grabbing with QT??? XXX XXX XXX XXX
 
@@ -705,7 +733,7 @@ class ObsPyck(QtGui.QMainWindow):
         if not widgets.qToolButton_trigger.isChecked():
             self.canv.setFocus() # XXX needed??
             return
-        self.updatePlot()
+        self.schedulePlotUpdate()
         # reset focus to matplotlib figure
         self.canv.setFocus() # XXX needed?? # XXX do we still need this focus grabbing with QT??? XXX XXX XXX XXX
 
@@ -720,31 +748,21 @@ class ObsPyck(QtGui.QMainWindow):
             widget = getattr(self.widgets, name)
             widget.setEnabled(not state)
         if state:
-            msg = "Showing spectrograms (takes a few seconds with log-option)."
+            msg = "Showing spectrograms."
+            self.requestSpectrogram()
         else:
             msg = "Showing seismograms."
+            self.hideSpectrograms()
         print msg
-        xmin, xmax = self.axs[0].get_xlim()
-        self.delAllItems()
-        self.delAxes()
-        self.fig.clear()
-        self.drawAxes()
-        self.drawAllItems()
-        self.multicursorReinit()
-        self.axs[0].set_xlim(xmin, xmax)
-        self.updatePlot()
 
     def on_qCheckBox_spectrogramLog_toggled(self):
-        if self.widgets.qToolButton_spectrogram.isChecked():
-            self.on_qToolButton_spectrogram_toggled()
+        self.requestSpectrogram()
 
     def on_qDoubleSpinBox_wlen_valueChanged(self):
-        if self.widgets.qToolButton_spectrogram.isChecked():
-            self.on_qToolButton_spectrogram_toggled()
+        self.requestSpectrogram()
 
     def on_qDoubleSpinBox_perlap_valueChanged(self):
-        if self.widgets.qToolButton_spectrogram.isChecked():
-            self.on_qToolButton_spectrogram_toggled()
+        self.requestSpectrogram()
 
     def closeEvent(self, event):
         reply = QtGui.QMessageBox.question(self, u'Сообщение',
@@ -760,10 +778,10 @@ class ObsPyck(QtGui.QMainWindow):
     ### signal handlers END ###### ############################################
     ###########################################################################
 
-    def _filter(self, stream):
+    def filterSettings(self):
         """
-        Applies filter currently selected in GUI to Trace or Stream object.
-        Also displays a message.
+        Filter currently selected in GUI as (type, options), options being
+        a sorted tuple of items (usable as a key).
         """
         w = self.widgets
         type = str(w.qComboBox_filterType.currentText()).lower()
@@ -777,19 +795,18 @@ class ObsPyck(QtGui.QMainWindow):
             options['freq'] = w.qDoubleSpinBox_lowpass.value()
         elif type == "highpass":
             options['freq'] = w.qDoubleSpinBox_highpass.value()
+        return type, tuple(sorted(options.items()))
+
+    def filterMessage(self, type, options):
+        options = dict(options)
         if type in ("bandpass", "bandstop"):
-            msg = "%s (zerophase=%s): %.2f-%.2f Hz" % \
+            return "%s (zerophase=%s): %.2f-%.2f Hz" % \
                     (type, options['zerophase'],
                      options['freqmin'], options['freqmax'])
         elif type in ("lowpass", "highpass"):
-            msg = "%s (zerophase=%s): %.2f Hz" % \
+            return "%s (zerophase=%s): %.2f Hz" % \
                     (type, options['zerophase'], options['freq'])
-        #try:
-        stream.filter(type, **options)
-        print msg
-        #except:
-        err = "Error during filtering. Showing unfiltered data."
-        print >> sys.stderr, err
+        return type
 
     def _rotateLQT(self, stream, origin):
         pass
@@ -797,51 +814,64 @@ class ObsPyck(QtGui.QMainWindow):
     def _rotateZRT(self, stream, origin):
         pass
 
-    def _trigger(self, stream):
+    def triggerSettings(self):
         """
-        Run recSTALTA trigger on stream/trace.
-        Exception handling should be done outside this function.
-        Also displays a message.
+        recSTALTA trigger parameters currently selected in GUI: (sta, lta).
         """
-        sta = self.widgets.qDoubleSpinBox_sta.value()
-        lta = self.widgets.qDoubleSpinBox_lta.value()
-        stream.trigger("recstalta", sta=sta, lta=lta)
-        print "Showing recSTALTA triggered traces."
+        return (self.widgets.qDoubleSpinBox_sta.value(),
+                self.widgets.qDoubleSpinBox_lta.value())
 
     def _arpicker(self):
         """
         Run AR picker on all streams and set P/S picks accordingly.
         Also displays a message.
+        Stations are picked in a process pool, picks are set as stations
+        are done; lines are left to the caller (one redraw at the end).
         """
-        f1 = self.options.ar_f1
-        f2 = self.options.ar_f2
-        sta_p = self.options.ar_sta_p
-        lta_p = self.options.ar_lta_p
-        sta_s = self.options.ar_sta_s
-        lta_s = self.options.ar_lta_s
-        m_p = self.options.ar_m_p
-        m_s = self.options.ar_m_s
-        l_p = self.options.ar_l_p
-        l_s = self.options.ar_l_s
         print "Setting automatic picks using AR picker:"
+        stations = []
         for i, st in enumerate(self.streams):
-            z = st.select(component="Z")[0].data
-            n = st.select(component="N")[0].data
-            e = st.select(component="E")[0].data
-            spr = st[0].stats.sampling_rate
-            p, s = arPick(z, n, e, spr, f1, f2, lta_p, sta_p, lta_s, sta_s,
-                          m_p, m_s, l_p, l_s)
+            arrays = stream_components(st)
+            if arrays is None:
+                print >> sys.stderr, "%s: no Z, N and E components, " \
+                    "skipped." % st[0].stats.station
+                continue
+            stations.append((i, arrays, st[0].stats.sampling_rate))
+        progress = QtGui.QProgressDialog("AR picker...", "Cancel", 0,
+                                         len(stations), self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        done = 0
+        picks = ar_picks(stations, ar_params(self.options),
+                         self.options.ar_processes, timeout=0.05)
+        for result in picks:
+            QtGui.QApplication.processEvents()
+            if progress.wasCanceled():
+                picks.close()
+                print >> sys.stderr, "AR picker cancelled."
+                break
+            if result is None:
+                continue
+            done += 1
+            progress.setValue(done)
+            i, p, s = result
+            st = self.streams[i]
             net = st[0].stats.network
             sta = st[0].stats.station
+            if p is None:
+                print >> sys.stderr, "%s.%s: AR picker failed: %s" % (net,
+                    sta, s)
+                continue
+            # arPick возвращает секунды от начала трассы
+            offset = self.time_abs2rel(st[0].stats.starttime)
+            p += offset
+            s += offset
             print "%s.%s: P set at %.3f (%s)" % (net, sta, p, self.time_rel2abs(p))
             print "%s.%s: S set at %.3f (%s)" % (net, sta, s, self.time_rel2abs(s))
             d = self.dicts[i]
             d['P'] = p
             d['S'] = s
-            for key in ['P', 'S']:
-                self.updateLine(key)
-                self.updateLabel(key)
-        return            
+        progress.setValue(len(stations))
 
     def debug(self):
         sys.stdout = self.stdout_backup
@@ -884,9 +914,9 @@ class ObsPyck(QtGui.QMainWindow):
         ymax = PHASE_LINEHEIGHT_PERC[key]
         # draw lines and store references in dictionary
         for ax in self.axs:
-            line = ax.axvline(d[key], color=PHASE_COLORS[key],
+            line = self.overlay.add(ax.axvline(d[key], color=PHASE_COLORS[key],
                     linewidth=AXVLINEWIDTH, linestyle=PHASE_LINESTYLES[key],
-                    ymin=ymin, ymax=ymax)
+                    ymin=ymin, ymax=ymax))
             self.lines[key][ax] = line
     
     def delLine(self, key):
@@ -899,7 +929,7 @@ class ObsPyck(QtGui.QMainWindow):
         if key not in self.lines:
             return
         for ax, line in self.lines[key].iteritems():
-            ax.lines.remove(line)
+            self.overlay.remove(line)
         del self.lines[key]
 
     def updateLine(self, key):
@@ -938,9 +968,9 @@ class ObsPyck(QtGui.QMainWindow):
         ax = self.axs[0]
         # draw text and store references in dictionary
         self.texts[key] = {}
-        text = ax.text(dict[key], 1 - 0.01 * len(self.axs), '  ' + label,
-                transform=self.trans[0], color=PHASE_COLORS[key],
-                family='monospace', va="top")
+        text = self.overlay.add(ax.text(dict[key], 1 - 0.01 * len(self.axs),
+                '  ' + label, transform=self.trans[0], color=PHASE_COLORS[key],
+                family='monospace', va="top"))
         self.texts[key][ax] = text
 
     def drawSynthLabel(self, key):
@@ -956,9 +986,9 @@ class ObsPyck(QtGui.QMainWindow):
         ax = self.axs[0]
         # draw text and store references in dictionary
         self.texts[key] = {}
-        text = ax.text(dict[key], 1 - 0.03 * len(self.axs), '  ' + label,
-                transform=self.trans[0], color=PHASE_COLORS[key],
-                family='monospace', va="top")
+        text = self.overlay.add(ax.text(dict[key], 1 - 0.03 * len(self.axs),
+                '  ' + label, transform=self.trans[0], color=PHASE_COLORS[key],
+                family='monospace', va="top"))
         self.texts[key][ax] = text
     
     def delLabel(self, key):
@@ -970,7 +1000,7 @@ class ObsPyck(QtGui.QMainWindow):
         if key not in self.texts:
             return
         for ax, text in self.texts[key].iteritems():
-            ax.texts.remove(text)
+            self.overlay.remove(text)
         del self.texts[key]
 
     def updateLabel(self, key):
@@ -1038,10 +1068,11 @@ class ObsPyck(QtGui.QMainWindow):
         ylims = list(ax.get_ylim())
         keyT = key + "T"
         self.lines[key] = {}
-        line = ax.plot((d[keyT],), (d[key],), markersize=MAG_MARKER['size'],
+        line = self.overlay.add(ax.plot((d[keyT],), (d[key],),
+                markersize=MAG_MARKER['size'],
                 markeredgewidth=MAG_MARKER['edgewidth'],
                 color=PHASE_COLORS['Mag'], marker=MAG_MARKER['marker'],
-                zorder=2000)[0]
+                zorder=2000)[0])
         self.lines[key][ax] = line
         ax.set_xlim(xlims)
         ax.set_ylim(ylims)
@@ -1078,6 +1109,9 @@ class ObsPyck(QtGui.QMainWindow):
         self.trans = trans
         t = []
         self.t = t
+        plotdata = []
+        self.plotdata = plotdata
+        self.yLimitsStale = False
         for i, tr in enumerate(st):
             if i == 0:
                 ax = fig.add_subplot(len(st), 1, 1)
@@ -1086,24 +1120,17 @@ class ObsPyck(QtGui.QMainWindow):
                 ax.xaxis.set_ticks_position("top")
             axs.append(ax) 
             # relative x-axis times start with 0 at global reference time
-            starttime_relative = self.time_abs2rel(tr.stats.starttime)
-            sampletimes = np.arange(starttime_relative,
-                    starttime_relative + (tr.stats.delta * tr.stats.npts),
-                    tr.stats.delta)
-            # XXX sometimes our arange is one item too long (why??), so we just cut
-            # off the last item if this is the case
-            if len(sampletimes) == tr.stats.npts + 1:
-                sampletimes = sampletimes[:-1]
-            t.append(sampletimes)
+            t.append(TimeAxis.from_trace(tr, self.T0))
             trans.append(matplotlib.transforms.blended_transform_factory(ax.transData,
                                                                          ax.transAxes))
             ax.xaxis.set_major_formatter(FuncFormatter(formatXTicklabels))
             # normalize with overall sensitivity and convert to nm/s
             # if not explicitly deactivated on command line
             if not self.options.nonormalization and not self.options.nometadata:
-                plts.append(ax.plot(sampletimes, tr.data / tr.stats.paz.sensitivity * 1e9, color='k', zorder=1000)[0])
+                plotdata.append(tr.data / tr.stats.paz.sensitivity * 1e9)
             else:
-                plts.append(ax.plot(sampletimes, tr.data, color='k', zorder=1000)[0])
+                plotdata.append(tr.data)
+            plts.append(ax.plot(*self.lodData(i), color='k', zorder=1000)[0])
             textcolor = "blue"
         self.drawIds()
         axs[-1].xaxis.set_ticks_position("both")
@@ -1114,6 +1141,60 @@ class ObsPyck(QtGui.QMainWindow):
         self.yMin, self.yMax = axs[0].get_ylim()
         fig.subplots_adjust(bottom=0.001, hspace=0.000, right=0.999, top=0.999, left=0.001)
     
+    def setStreamData(self):
+        """
+        Put the current stream into the axes shown (same number of
+        components): swap time axes and ids, reset the x zoom limits.
+        The data and y limits are set by updatePlot (see setYLimits).
+        """
+        st = self.streams[self.stPt]
+        self.t = [TimeAxis.from_trace(tr, self.T0) for tr in st]
+        self.updateIds("blue")
+        # limits showing the whole stream (as autoscaling in drawAxes)
+        xmin = min(t.start for t in self.t)
+        xmax = max(t.end for t in self.t)
+        locator = self.axs[0].xaxis.get_major_locator()
+        self.xMin, self.xMax = locator.view_limits(xmin, xmax)
+        # y limits depend on the prepared (normalized, filtered) data
+        self.yLimitsStale = True
+
+    def setYLimits(self):
+        """
+        Zoom limits in y showing the whole plotted data (as autoscaling in
+        drawAxes), from the prepared data (self.plotdata).
+        """
+        ax = self.axs[0]
+        ymin = min(data.min() for data in self.plotdata if len(data))
+        ymax = max(data.max() for data in self.plotdata if len(data))
+        self.yMin, self.yMax = ax.yaxis.get_major_locator().view_limits(ymin, ymax)
+        ax.set_ylim(self.yMin, self.yMax)
+        self.yLimitsStale = False
+
+    def stashAxes(self):
+        """
+        Remove the stream axes from the figure, keeping them (with lines and
+        transforms) in the pool for streams with the same number of
+        components.
+        """
+        self.axesPool[len(self.axs)] = (self.axs, self.plts, self.trans)
+        self.delAxes()
+
+    def restoreAxes(self):
+        """
+        Show the current stream in axes from the pool.
+        Returns False if there are none for its number of components.
+        """
+        key = len(self.streams[self.stPt])
+        if key not in self.axesPool:
+            return False
+        self.axs, self.plts, self.trans = self.axesPool.pop(key)
+        for ax in self.axs:
+            self.fig.add_axes(ax)
+        if self.supTit not in self.fig.texts:
+            self.fig.texts.append(self.supTit)
+        self.setStreamData()
+        return True
+
     def delAxes(self):
         for ax in self.axs:
             if ax in self.fig.axes: 
@@ -1126,23 +1207,316 @@ class ObsPyck(QtGui.QMainWindow):
         for line in self.multicursor.lines:
             line.set_visible(False)
         self.canv.draw()
+
+    def redrawPicks(self):
+        """
+        Redraw only pick lines, labels and the cursor over the cached
+        waveforms (blitting instead of a full canvas draw).
+        """
+        self.overlay.update()
+
+    def lodData(self, i, xmin=None, xmax=None):
+        """
+        Times and values to plot for trace i in x-range [xmin, xmax] (whole
+        trace by default): min/max pairs per pixel column of the axes, raw
+        samples when zoomed in far enough.
+        """
+        t = self.t[i]
+        if xmin is None:
+            xmin, xmax = t.start, t.end
+        # ширина, под которую построены огибающие (см. __mpl_resizeEvent)
+        self.lodWidth = self.axs[i].bbox.width
+        return minmax_envelope(self.plotdata[i], t.start, t.delta, xmin, xmax,
+                               self.lodWidth)
+
+    def updateLOD(self):
+        """
+        Recompute the plotted traces for the current x-range (call after
+        zooming or changing the plotted data).
+        """
+        if self.widgets.qToolButton_overview.isChecked():
+            self.updateOverviewLOD()
+            return
+        xmin, xmax = self.axs[0].get_xlim()
+        for i, plot in enumerate(self.plts):
+            plot.set_data(*self.lodData(i, xmin, xmax))
+        self.requestSpectrogram()
     
     def updatePlot(self):
         """
         Update plot either with raw data or filter data and use filtered data.
-        Depending on status of "Filter" Button. Also check "Rotate" buttons if
-        data should be rotated to LQT or ZRT coordinates.
+        Depending on status of "Filter" Button. The data is prepared in
+        background if possible (see prefetchAdjacent).
         """
-        # XXX copying is only necessary if "Filter" or "Rotate" is selected
-        # XXX it is simpler for teh code to just copy in any case..
-        st = self.streams[self.stPt].copy()
-        d = self.dicts[self.stPt]
-        self.updateIds("blue")
+        settings = self.displaySettings()
+        filt, trig, normalize = settings
+        prepared = self.prefetcher.get(self.stPt, settings)
+        if prepared is None:
+            try:
+                prepared = self.prepareStream(self.stPt, settings)
+            except Exception, e:
+                err = "Error during filtering. Showing unfiltered data."
+                print >> sys.stderr, err, e
+                filt = trig = None
+                settings = (filt, trig, normalize)
+                prepared = self.prepareStream(self.stPt, settings)
+        if filt:
+            print self.filterMessage(*filt)
+            self.updateIds("red")
+        else:
+            if trig:
+                print "Showing recSTALTA triggered traces."
+            self.updateIds("blue")
+        self.showPrepared(prepared)
         self.redraw()
-            
-        # Update all plots' y data
-        for tr, plot in zip(st, self.plts):
-            plot.set_ydata(tr.data)
+        self.prefetchAdjacent()
+
+    def schedulePlotUpdate(self):
+        """
+        Update plot after the filter/trigger parameters stopped changing for
+        a moment: holding an arrow key on a spin box restarts the timer
+        instead of refiltering on every step.
+        """
+        self.plotUpdateTimer.start()
+
+    def startPlotUpdate(self):
+        """
+        Prepare the current stream with the current settings in the prefetch
+        thread. Work for superseded settings is cancelled there, the plot
+        is updated by checkPlotUpdate when the result is ready.
+        """
+        self.plotPending = None
+        self.plotPollTimer.stop()
+        if self.widgets.qToolButton_overview.isChecked():
+            # обзор: поток перерисует updatePlot при выходе из обзора
+            return
+        settings = self.displaySettings()
+        if self.prefetcher.get(self.stPt, settings) is not None:
+            self.updatePlot()
+            return
+        xlim = tuple(self.axs[0].get_xlim())
+        ncols = self.axs[0].bbox.width
+        self.prefetcher.request(self.stPt, settings, xlim, ncols)
+        self.plotPending = (self.stPt, settings)
+        self.plotPollTimer.start()
+
+    def checkPlotUpdate(self):
+        if self.plotPending is None:
+            self.plotPollTimer.stop()
+            return
+        index, settings = self.plotPending
+        if index != self.stPt or settings != self.displaySettings() or \
+           self.widgets.qToolButton_overview.isChecked():
+            # устарело: сменился поток или параметры (их обновит свой вызов)
+            # или включён обзор
+            self.plotPending = None
+            self.plotPollTimer.stop()
+            return
+        if self.prefetcher.get(index, settings) is None and \
+           self.prefetcher.is_pending(index, settings):
+            return
+        self.plotPending = None
+        self.plotPollTimer.stop()
+        # готово (или ошибка в потоке - тогда updatePlot сделает всё сам)
+        self.updatePlot()
+
+    def displaySettings(self):
+        """
+        Settings the displayed data depends on (see prepareStream): filter,
+        trigger (None if switched off) and normalization.
+        """
+        w = self.widgets
+        filt = trig = None
+        if w.qToolButton_filter.isChecked():
+            filt = self.filterSettings()
+        if w.qToolButton_trigger.isChecked():
+            trig = self.triggerSettings()
+        normalize = not self.options.nonormalization and \
+                    not self.options.nometadata
+        return filt, trig, normalize
+
+    def prepareStream(self, index, settings, xlim=None, ncols=None):
+        """
+        Data of stream index ready for display: (time axes, data arrays,
+        (xlim, ncols, envelopes for x-range xlim) or None).
+        Runs in the prefetch thread too, so must not touch the GUI.
+        """
+        st = self.streams[index]
+        t = [TimeAxis.from_trace(tr, self.T0) for tr in st]
+        data = self.filteredData(st, *settings)
+        lod = None
+        if xlim is not None:
+            lod = (xlim, ncols, [minmax_envelope(d, ta.start, ta.delta,
+                xlim[0], xlim[1], ncols) for ta, d in zip(t, data)])
+        return t, data, lod
+
+    def filteredData(self, traces, filt, trig, normalize=False):
+        """
+        Data arrays of traces (Stream or list of traces) with filter, trigger
+        (see displaySettings) and normalization (waveforms only) applied.
+        Results are cached by stream id and settings, so toggling back to a
+        filter setting or returning to a stream does not filter again.
+        """
+        # the characteristic function of the trigger is not normalized
+        normalize = normalize and not trig
+        key = (stream_key(traces), filt, trig, normalize)
+        data = self.filterCache.get(key)
+        if data is not None:
+            return data
+        st = Stream(list(traces))
+        if filt:
+            st = st.copy()
+            type, options = filt
+            st.filter(type, **dict(options))
+        if trig:
+            # all traces at once, the stream is not copied
+            sta, lta = trig
+            data = trigger_traces(st, sta, lta)
+        else:
+            data = [tr.data for tr in st]
+        if normalize:
+            # normalize with overall sensitivity and convert to nm/s
+            data = [d / tr.stats.paz.sensitivity * 1e9
+                    for d, tr in zip(data, st)]
+        self.filterCache.put(key, data, sum(d.nbytes for d in data))
+        return data
+
+    def showPrepared(self, prepared):
+        """
+        Put stream data prepared by prepareStream into the plots.
+        """
+        t, data, lod = prepared
+        self.t = list(t)
+        self.plotdata = list(data)
+        if self.yLimitsStale:
+            self.setYLimits()
+        xlim = tuple(self.axs[0].get_xlim())
+        if lod is not None and lod[0] == xlim and \
+           lod[1] == self.axs[0].bbox.width:
+            for plot, xy in zip(self.plts, lod[2]):
+                plot.set_data(*xy)
+            self.lodWidth = lod[1]
+            self.requestSpectrogram()
+        else:
+            self.updateLOD()
+
+    def prefetchAdjacent(self):
+        """
+        Prepare the next and the previous stream in background with the
+        current display settings and x-range.
+        """
+        if self.stNum < 2 or self.widgets.qToolButton_overview.isChecked():
+            return
+        settings = self.displaySettings()
+        xlim = tuple(self.axs[0].get_xlim())
+        ncols = self.axs[0].bbox.width
+        for index in ((self.stPt + 1) % self.stNum, (self.stPt - 1) % self.stNum):
+            self.prefetcher.request(index, settings, xlim, ncols)
+
+    def spectrogramSettings(self):
+        """
+        Spectrogram parameters selected in GUI: (wlen, per_lap, log).
+        """
+        w = self.widgets
+        return (w.qDoubleSpinBox_wlen.value(), w.qDoubleSpinBox_perlap.value(),
+                w.qCheckBox_spectrogramLog.isChecked())
+
+    def prepareSpectrogram(self, index, settings):
+        """
+        Spectrograms of all components of stream index for settings
+        (wlen, per_lap, log, x-range, pixel columns), see batch_spectrogram.
+        Runs in a background thread, so must not touch the GUI.
+        """
+        st = self.streams[index]
+        key = (stream_key(st), settings)
+        result = self.spectrogramCache.get(key)
+        if result is not None:
+            return result
+        wlen, per_lap, log, (xmin, xmax), ncols = settings
+        t = TimeAxis.from_trace(st[0], self.T0)
+        result = batch_spectrogram([tr.data for tr in st], t.start, t.delta,
+            wlen, per_lap, xmin, xmax, ncols, log)
+        if result is None:
+            # интервал короче окна - кэшировать нечего
+            return
+        self.spectrogramCache.put(key, result, result[0].nbytes)
+        return result
+
+    def requestSpectrogram(self):
+        """
+        Show spectrograms of the current stream for the visible x-range
+        (if switched on). They are computed in background, older requests
+        are cancelled, checkSpectrogram shows the latest result.
+        """
+        if not self.widgets.qToolButton_spectrogram.isChecked() or \
+           self.widgets.qToolButton_overview.isChecked():
+            return
+        settings = self.spectrogramSettings() + (
+            tuple(self.axs[0].get_xlim()), self.axs[0].bbox.width)
+        self.spectrograms.request(self.stPt, settings)
+        self.specPending = (self.stPt, settings)
+        self.specPollTimer.start()
+
+    def checkSpectrogram(self):
+        if self.specPending is None:
+            self.specPollTimer.stop()
+            return
+        index, settings = self.specPending
+        result = self.spectrograms.get(index, settings)
+        if result is None and self.spectrograms.is_pending(index, settings):
+            return
+        self.specPending = None
+        self.specPollTimer.stop()
+        if index != self.stPt or \
+           not self.widgets.qToolButton_spectrogram.isChecked():
+            return
+        if result is None:
+            print >> sys.stderr, "Spectrogram could not be computed " \
+                "(window longer than visible data?)."
+            return
+        self.showSpectrogram(result)
+
+    def showSpectrogram(self, result):
+        """
+        Put spectrograms computed by prepareSpectrogram into the axes (in
+        place of the seismograms).
+        """
+        spec, extent = result
+        xlim = self.axs[0].get_xlim()
+        for ax, plot, data in zip(self.axs, self.plts, spec):
+            image = self.specImages.get(ax)
+            if image is None:
+                image = ax.imshow(data, origin="lower", aspect="auto",
+                    extent=extent, interpolation="nearest",
+                    cmap=self.spectrogramColormap, zorder=1)
+                self.specImages[ax] = image
+            else:
+                image.set_data(data)
+                image.set_extent(extent)
+            image.set_clim(data.min(), data.max())
+            plot.set_visible(False)
+        # imshow меняет пределы осей
+        self.axs[0].set_xlim(xlim)
+        self.axs[0].set_ylim(extent[2], extent[3])
+        self.redraw()
+
+    def hideSpectrograms(self):
+        """
+        Remove spectrogram images (also from axes in the pool), show the
+        seismograms again.
+        """
+        for image in self.specImages.values():
+            try:
+                image.remove()
+            except ValueError:
+                pass
+        self.specImages = {}
+        self.specPending = None
+        self.specPollTimer.stop()
+        self.spectrograms.invalidate()
+        for plot in self.plts:
+            plot.set_visible(True)
+        self.axs[0].set_ylim(self.yMin, self.yMax)
         self.redraw()
 
     # Define the event that handles the setting of P- and S-wave picks
@@ -1166,22 +1540,19 @@ class ObsPyck(QtGui.QMainWindow):
             # some keyPress events only make sense inside our matplotlib axes
             if ev.inaxes not in self.axs:
                 return
-            # get the correct sample times array for the click
+            # no picking in the overview
+            if self.widgets.qToolButton_overview.isChecked():
+                return
+            # get the correct time axis for the click
             t = self.t[self.axs.index(ev.inaxes)]
-            # We want to round from the picking location to
-            # the time value of the nearest sample:
             samp_rate = st[0].stats.sampling_rate
-            pickSample = (ev.xdata - t[0]) * samp_rate
-            print pickSample
-            pickSample = round(pickSample)
-            print pickSample
             # we need the position of the cursor location
-            # in the seismogram array:
-            xpos = pickSample
+            # in the seismogram array (the nearest sample):
+            xpos = t.index(ev.xdata)
             # Determine the time of the nearest sample
-            pickSample = t[pickSample]
+            pickSample = t[xpos]
             print pickSample
-            print ev.inaxes.lines[0].get_ydata()[xpos]
+            print self.plotdata[self.axs.index(ev.inaxes)][xpos]
 
         if ev.key == keys['setPick']:
             # some keyPress events only make sense inside our matplotlib axes
@@ -1204,7 +1575,7 @@ class ObsPyck(QtGui.QMainWindow):
                 if key2 in dict and dict[phase_type] > dict[key2]:
                     self.delLine(key2)
                     self.delKey(key2)
-                self.redraw()
+                self.redrawPicks()
                 abs_time = self.time_rel2abs(dict[phase_type])
                 print "%s set at %.3f (%s)" % (KEY_FULLNAMES[phase_type],
                     dict[phase_type], abs_time.isoformat())
@@ -1217,7 +1588,7 @@ class ObsPyck(QtGui.QMainWindow):
                 key = phase_type + "Weight"
                 dict[key] = keys['setWeight'][ev.key]
                 self.updateLabel(phase_type)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set to %i" % (KEY_FULLNAMES[key], dict[key])
                 return
 
@@ -1239,7 +1610,7 @@ class ObsPyck(QtGui.QMainWindow):
                               "over R or T axes."
                         print >> sys.stderr, err
                 self.updateLabel(phase_type)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set to %s" % (KEY_FULLNAMES[key], dict[key])
                 return
 
@@ -1250,7 +1621,7 @@ class ObsPyck(QtGui.QMainWindow):
                 key = phase_type + "Onset"
                 dict[key] = keys['setOnset'][ev.key]
                 self.updateLabel(phase_type)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set to %s" % (KEY_FULLNAMES[key], dict[key])
                 return
 
@@ -1263,7 +1634,7 @@ class ObsPyck(QtGui.QMainWindow):
                 for key in depending_keys:
                     self.delKey(key)
                 self.delLabel(phase_type)
-                self.redraw()
+                self.redrawPicks()
                 return
 
         if ev.key == keys['setPickError']:
@@ -1280,7 +1651,7 @@ class ObsPyck(QtGui.QMainWindow):
                     key = phase_type + 'Err2'
                 dict[key] = pickSample
                 self.updateLine(key)
-                self.redraw()
+                self.redrawPicks()
                 abs_time = self.time_rel2abs(dict[key])
                 print "%s set at %.3f (%s)" % (KEY_FULLNAMES[key],
                                                dict[key], abs_time.isoformat())
@@ -1308,7 +1679,7 @@ class ObsPyck(QtGui.QMainWindow):
                 keyT = key + 'T'
                 keyT_other = key_other + 'T'
                 # do the actual work
-                ydata = ev.inaxes.lines[0].get_ydata() #get the first line hoping that it is the seismogram!
+                ydata = self.plotdata[self.axs.index(ev.inaxes)] # plotted lines are decimated, use the data
                 cutoffSamples = xpos - MAG_PICKWINDOW #remember, how much samples there are before our small window! We have to add this number for our MagMinT estimation!
                 dict[key] = np.min(ydata[xpos-MAG_PICKWINDOW:xpos+MAG_PICKWINDOW])
                 # special handling for GSE2 data: apply calibration
@@ -1324,7 +1695,7 @@ class ObsPyck(QtGui.QMainWindow):
                     self.delKey(key_other)
                     self.delKey(keyT_other)
                 self.updateMagMarker(key)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set: %s at %.3f" % (KEY_FULLNAMES[key], dict[key],
                                               dict[keyT])
                 return
@@ -1351,7 +1722,7 @@ class ObsPyck(QtGui.QMainWindow):
                 keyT = key + 'T'
                 keyT_other = key_other + 'T'
                 # do the actual work
-                ydata = ev.inaxes.lines[0].get_ydata() #get the first line hoping that it is the seismogram!
+                ydata = self.plotdata[self.axs.index(ev.inaxes)] # plotted lines are decimated, use the data
                 cutoffSamples = xpos - MAG_PICKWINDOW #remember, how much samples there are before our small window! We have to add this number for our MagMaxT estimation!
                 dict[key] = np.max(ydata[xpos-MAG_PICKWINDOW:xpos+MAG_PICKWINDOW])
                 # special handling for GSE2 data: apply calibration
@@ -1367,7 +1738,7 @@ class ObsPyck(QtGui.QMainWindow):
                     self.delKey(key_other)
                     self.delKey(keyT_other)
                 self.updateMagMarker(key)
-                self.redraw()
+                self.redrawPicks()
                 print "%s set: %s at %.3f" % (KEY_FULLNAMES[key], dict[key],
                                               dict[keyT])
                 return
@@ -1384,7 +1755,7 @@ class ObsPyck(QtGui.QMainWindow):
                         self.delKey(key)
                 else:
                     return
-                self.redraw()
+                self.redrawPicks()
                 return
         #######################################################################
         # End of key events related to picking                                #
@@ -1403,12 +1774,18 @@ class ObsPyck(QtGui.QMainWindow):
             
         if ev.key == keys['prevStream']:
             if self.widgets.qToolButton_overview.isChecked():
+                # scroll the overview by a page
+                self.scrollOverview(-self.overviewRows)
+                self.redraw()
                 return
             self.on_qToolButton_previousStream_clicked()
             return
 
         if ev.key == keys['nextStream']:
             if self.widgets.qToolButton_overview.isChecked():
+                # scroll the overview by a page
+                self.scrollOverview(self.overviewRows)
+                self.redraw()
                 return
             self.on_qToolButton_nextStream_clicked()
             return
@@ -1428,6 +1805,12 @@ class ObsPyck(QtGui.QMainWindow):
             ax = self.axEventMap
         else:
             ax = self.axs[0]
+        # scroll the overview rows with Ctrl+wheel
+        if self.widgets.qToolButton_overview.isChecked() and \
+           ev.modifiers() == QtCore.Qt.ControlModifier:
+            self.scrollOverview(3 if ev.delta() < 0 else -3)
+            self.redraw()
+            return
         (left, right) = ax.get_xbound()
         (bottom, top) = ax.get_ybound()
         # Get the keyboard modifiers. They are a enum type.
@@ -1460,8 +1843,17 @@ class ObsPyck(QtGui.QMainWindow):
                 bottom /= 2
         ax.set_xbound(lower=left, upper=right)
         ax.set_ybound(lower=bottom, upper=top)
+        if not self.widgets.qToolButton_showMap.isChecked():
+            self.updateLOD()
         self.redraw()
     
+    def __mpl_resizeEvent(self, ev):
+        # огибающие построены под прежнюю ширину осей - пересчитать
+        if self.widgets.qToolButton_showMap.isChecked() or not self.axs or \
+           self.axs[0].bbox.width == self.lodWidth:
+            return
+        self.updateLOD()
+
     # Define zoom reset for the mouse button 2 (always wheel wheel!?)
     def __mpl_mouseButtonPressEvent(self, ev):
         if self.widgets.qToolButton_showMap.isChecked():
@@ -1493,6 +1885,7 @@ class ObsPyck(QtGui.QMainWindow):
             ax.set_xbound(lower=self.xMin, upper=self.xMax)
             ax.set_ybound(lower=self.yMin, upper=self.yMax)
             # Update all subplots
+            self.updateLOD()
             self.redraw()
             print "Resetting axes"
     
@@ -1505,6 +1898,8 @@ class ObsPyck(QtGui.QMainWindow):
             # XXX self.canv.widgetlock.release(self.toolbar)
 
     def __mpl_motionNotifyEvent(self, ev):
+        # called with the latest event once per frame (see MotionCoalescer):
+        # update position labels and blit the cursor in all axes at once
         try:
             if ev.inaxes in self.axs:
                 self.widgets.qLabel_xdata_rel.setText(formatXTicklabels(ev.xdata))
@@ -1517,12 +1912,13 @@ class ObsPyck(QtGui.QMainWindow):
                 self.widgets.qLabel_ydata.setText(str(ev.ydata))
         except TypeError:
             pass
+        self.multicursor.onmove(ev)
     
     #lookup multicursor source: http://matplotlib.sourcearchive.com/documentation/0.98.1/widgets_8py-source.html
     def multicursorReinit(self):
-        self.canv.mpl_disconnect(self.multicursor.id1)
-        self.canv.mpl_disconnect(self.multicursor.id2)
+        self.multicursor.disconnect()
         self.multicursor.__init__(self.canv, self.axs, useblit=True,
+                                  overlay=self.overlay, motion=False,
                                   color='black', linewidth=1, ls='dotted')
         self.updateMulticursorColor()
         # XXX self.canv.widgetlock.release(self.toolbar)
@@ -2601,61 +2997,124 @@ class ObsPyck(QtGui.QMainWindow):
             del self.axWadati
 
     def drawStreamOverview(self):
-        stNum = len(self.streams)
+        # rows are filtered when they come into view
+        self.overviewSettings = self.displaySettings()
+        filt, trig, _ = self.overviewSettings
+        if filt:
+            print self.filterMessage(*filt)
+        if trig:
+            print "Showing recSTALTA triggered traces."
+        # traces are normalized each, no need to convert to nm/s
+        self.drawOverviewTraces([st.select(component="Z")[0]
+                                 for st in self.streams])
+
+    def drawOverviewTraces(self, traces):
+        """
+        Draw traces (one per stream) as a scrollable record section in a
+        single axes: one LineCollection with every trace normalized to its
+        own row (first stream on top), trace ids as y tick labels.
+        Only the rows in view are prepared and decimated (see
+        updateOverviewLOD), so the cost depends on the number of visible
+        rows, not on the number of streams.
+        """
+        stNum = len(traces)
         fig = self.fig
-        axs = []
-        self.axs = axs
-        plts = []
-        self.plts = plts
-        trans = []
-        self.trans = trans
-        t = []
-        for i, st in enumerate(self.streams):
-            tr = st.select(component="Z")[0]
-            # make sure that the relative x-axis times start with 0 at the time
-            # specified as start time on command line
-            starttime_relative = self.time_abs2rel(tr.stats.starttime)
-            sampletimes = np.arange(starttime_relative,
-                    starttime_relative + (tr.stats.delta * tr.stats.npts),
-                    tr.stats.delta)
-            # sometimes our arange is one item too long (why??), so we just cut
-            # off the last item if this is the case
-            if len(sampletimes) == tr.stats.npts + 1:
-                sampletimes = sampletimes[:-1]
-            t.append(sampletimes)
-            if i == 0:
-                ax = fig.add_subplot(stNum, 1, i+1)
-            else:
-                ax = fig.add_subplot(stNum, 1, i+1, sharex=axs[0], sharey=axs[0])
-                ax.xaxis.set_ticks_position("top")
-            axs.append(ax)
-            trans.append(matplotlib.transforms.blended_transform_factory(ax.transData, ax.transAxes))
-            ax.xaxis.set_major_formatter(FuncFormatter(formatXTicklabels))
-            # we have to rotate first, because we have to copy the whole stream..
-            tr = tr.copy()
-            # rotation needs to be done first!
-            if self.widgets.qToolButton_filter.isChecked():
-                self._filter(tr)
-            if self.widgets.qToolButton_trigger.isChecked():
-                self._trigger(tr)
-            # normalize with overall sensitivity and convert to nm/s
-            # if not explicitly deactivated on command line
-            if not self.options.nonormalization and not self.options.nometadata:
-                # special handling for GSE2 data: apply calibration
-                calib = 1.0
-                if tr.stats._format == "GSE2":
-                    calib = tr.stats.calib * 2 * np.pi / tr.stats.gse2.calper
-                plts.append(ax.plot(sampletimes, tr.data * 1e9 / tr.stats.paz.sensitivity / calib, color='k', zorder=1000)[0])
-            else:
-                plts.append(ax.plot(sampletimes, tr.data, color='k', zorder=1000)[0])
-        self.drawIds()
-        axs[-1].xaxis.set_ticks_position("both")
-        label = self.T0.isoformat().replace("T", "  ")
-        self.supTit = fig.suptitle(label, ha="left", va="bottom",
-                                   x=0.01, y=0.01)
-        self.xMin, self.xMax = axs[0].get_xlim()
-        self.yMin, self.yMax = axs[0].get_ylim()
-        fig.subplots_adjust(bottom=0.001, hspace=0.000, right=0.999, top=0.999, left=0.001)
+        ax, collection, self.supTit = setup_overview_axes(fig, self.T0)
+        self.axs = [ax]
+        self.trans = [matplotlib.transforms.blended_transform_factory(
+            ax.transData, ax.transAxes)]
+        self.overviewTraces = traces
+        # make sure that the relative x-axis times start with 0 at the time
+        # specified as start time on command line
+        self.t = [TimeAxis.from_trace(tr, self.T0) for tr in traces]
+        self.plotdata = []
+        # prepared data and envelopes of rows
+        self.overviewCache = TraceCache(max_mb=64)
+        self.overviewRows = max(1, min(self.options.overview_rows, stNum))
+        self.overviewTop = 0
+        self.plts = [collection]
+        self.xMin = min(t.start for t in self.t)
+        self.xMax = max(t.end for t in self.t)
+        ax.set_xlim(self.xMin, self.xMax)
+        self.scrollOverview(0)
+
+    def overviewRow(self, i):
+        """
+        Prepared data of row i and its scale to half the row spacing.
+        """
+        row = self.overviewCache.get(("row", i))
+        if row is None:
+            row = self.putOverviewRow(i,
+                self.prepareOverviewTrace(self.overviewTraces[i]))
+        return row
+
+    def putOverviewRow(self, i, data):
+        row = (data, overview_scale(data))
+        self.overviewCache.put(("row", i), row, data.nbytes)
+        return row
+
+    def overviewOffset(self, i):
+        # first stream on top
+        return len(self.overviewTraces) - 1 - i
+
+    def scrollOverview(self, rows):
+        """
+        Scroll the overview by rows (negative - up) and show rows in view.
+        """
+        stNum = len(self.overviewTraces)
+        top = self.overviewTop + rows
+        self.overviewTop = max(0, min(top, stNum - self.overviewRows))
+        visible = range(self.overviewTop, self.overviewTop + self.overviewRows)
+        ax = self.axs[0]
+        # only the tick labels of visible rows exist
+        set_overview_rows(ax, [self.overviewOffset(i) for i in visible],
+                          [self.overviewTraces[i].id for i in visible])
+        self.yMin = self.overviewOffset(visible[-1]) - 0.5
+        self.yMax = self.overviewOffset(visible[0]) + 0.5
+        ax.set_ylim(self.yMin, self.yMax)
+        self.prepareOverviewRows(visible)
+        self.updateOverviewLOD()
+
+    def updateOverviewLOD(self):
+        """
+        Recompute the overview traces in view for the current x-range.
+        """
+        ax = self.axs[0]
+        xmin, xmax = ax.get_xlim()
+        ncols = ax.bbox.width
+        self.lodWidth = ncols
+        segments = []
+        for i in range(self.overviewTop, self.overviewTop + self.overviewRows):
+            key = ("lod", i, xmin, xmax, ncols)
+            segment = self.overviewCache.get(key)
+            if segment is None:
+                data, scale = self.overviewRow(i)
+                segment = overview_segment(data, scale, self.t[i],
+                    self.overviewOffset(i), xmin, xmax, ncols)
+                self.overviewCache.put(key, segment, segment.nbytes)
+            segments.append(segment)
+        self.plts[0].set_segments(segments)
+
+    def prepareOverviewRows(self, rows):
+        """
+        Prepare the rows not cached yet together (one filter and trigger
+        pass over all of them), see overviewRow.
+        """
+        rows = [i for i in rows if ("row", i) not in self.overviewCache]
+        if len(rows) < 2:
+            return
+        filt, trig, _ = self.overviewSettings
+        traces = [self.overviewTraces[i] for i in rows]
+        for i, data in zip(rows, self.filteredData(traces, filt, trig)):
+            self.putOverviewRow(i, data)
+
+    def prepareOverviewTrace(self, tr):
+        """
+        Data of trace tr as shown in the overview (filter and trigger
+        settings taken when the overview was drawn).
+        """
+        filt, trig, _ = self.overviewSettings
+        return self.filteredData([tr], filt, trig)[0]
 
     def drawEventMap(self):
         dM = self.dictMagnitude
@@ -3283,6 +3742,7 @@ def main():
     for opt_args, opt_kwargs in COMMANDLINE_OPTIONS:
         parser.add_option(*opt_args, **opt_kwargs)
     (options, args) = parser.parse_args()
+    set_packed24(options.packed24)
     #print options
     # For keybindings option, just print them and exit.
     if options.keybindings:
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Картинки событий для просмотра (PNG) без GUI.
+
+Для каждого события (idDir) рисуется обзор станций (компонента Z) как в
+режиме overview ObsPyck, с пикировками из базы данных. Рисование - на Agg,
+события - в пуле процессов; картинка, которая новее исходных файлов
+события, не перерисовывается.
+
+    python render_events.py -O review 1234 1235
+    python render_events.py -O review -f codes.txt
+"""
+import os
+import argparse
+import multiprocessing
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+
+from baikal import set_packed24
+from util import (SEISMIC_PHASES, PHASE_COLORS, PHASE_LINESTYLES,
+    PHASE_LINEHEIGHT_PERC, AXVLINEWIDTH, SELECT_CODES, TRACE_CACHE, TimeAxis,
+    db_path2filename, execute_query, setup_db_connection, setup_overview_axes,
+    set_overview_rows, overview_scale, overview_segment)
+from cleanobspyck import setup_dicts_streams, setup_times
+
+
+def event_files(cursor, options, code):
+    """ файлы данных события code (idDir) """
+    query = SELECT_CODES.replace("1", str(options.database))
+    items = execute_query(cursor, query, (code,)) or []
+    return [db_path2filename(Dir, fname) for _, Dir, fname in items]
+
+
+def is_up_to_date(image, files):
+    """ картинка есть и новее всех (существующих) файлов """
+    if not os.path.exists(image):
+        return False
+    mtime = os.path.getmtime(image)
+    return all(os.path.getmtime(f) < mtime for f in files if os.path.exists(f))
+
+
+def render_event(streams, dicts, T0, filename, width=1600, row_height=40,
+                 dpi=100):
+    """ нарисовать обзор станций события с пикировками в файл filename """
+    rows = [(st.select(component="Z")[0], dic)
+            for st, dic in zip(streams, dicts) if st.select(component="Z")]
+    rows.sort(key=lambda row: row[0].stats.station)
+    nrows = len(rows)
+    fig = Figure(figsize=(width / float(dpi),
+                          max(nrows * row_height, 300) / float(dpi)), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax, collection, _ = setup_overview_axes(fig, T0)
+    t = [TimeAxis.from_trace(tr, T0) for tr, _ in rows]
+    xmin = min(ta.start for ta in t)
+    xmax = max(ta.end for ta in t)
+    # первая станция - наверху
+    offsets = range(nrows - 1, -1, -1)
+    collection.set_segments([overview_segment(tr.data, overview_scale(tr.data),
+        ta, offset, xmin, xmax, width) for (tr, _), ta, offset in
+        zip(rows, t, offsets)])
+    set_overview_rows(ax, offsets, [tr.id for tr, _ in rows])
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(-0.5, nrows - 0.5)
+    # пикировки - отрезками в строках станций (как линии в GUI)
+    for key in SEISMIC_PHASES:
+        picks = [(dic[key], offset) for (_, dic), offset in zip(rows, offsets)
+                 if key in dic]
+        if not picks:
+            continue
+        height = PHASE_LINEHEIGHT_PERC[key]
+        ax.add_collection(LineCollection(
+            [[(x, offset + 0.5 - height), (x, offset - 0.5 + height)]
+             for x, offset in picks],
+            colors=PHASE_COLORS[key], linestyles=PHASE_LINESTYLES[key],
+            linewidths=AXVLINEWIDTH, zorder=2000))
+        for x, offset in picks:
+            ax.text(x, offset + 0.45, " " + key, color=PHASE_COLORS[key],
+                    va="top", family='monospace', zorder=2000)
+    # сначала во временный файл, чтобы не оставить половину картинки
+    tmp = filename + ".tmp.png"
+    fig.savefig(tmp, dpi=dpi)
+    if os.path.exists(filename): os.remove(filename)
+    os.rename(tmp, filename)
+
+
+# соединение с базой данных (в процессах пула)
+_db = None
+
+
+def _init_worker():
+    global _db
+    _db = setup_db_connection()
+    # каждое событие рисуется один раз - кэш трасс только занимал бы память
+    TRACE_CACHE.set_budget(0)
+
+
+def _render(task):
+    """ картинка события: (code, что сделано) """
+    code, options = task
+    if _db is None:
+        return code, "no database connection"
+    conn, cursor = _db
+    image = os.path.join(options.outdir, "%s.png" % code)
+    try:
+        files = event_files(cursor, options, code)
+        if not files:
+            return code, "no files"
+        if not options.force and is_up_to_date(image, files):
+            return code, "up to date"
+        streams, dicts = setup_dicts_streams(cursor, options, code,
+            SELECT_CODES)
+        if not streams:
+            return code, "no data"
+        T0, T1, dicts = setup_times(options, streams, dicts)
+        render_event(streams, dicts, T0, image, options.width)
+    except Exception, e:
+        return code, "failed: %s" % e
+    return code, "rendered"
+
+
+def main():
+    """ картинки событий из командной строки """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("codes", nargs="*", help="idDir codes of events.")
+    parser.add_argument("-f", "--fromfile", type=argparse.FileType('r'),
+        help="File with idDir codes (one per line).")
+    parser.add_argument("-O", "--outdir", default="review",
+        help="Directory for images.")
+    parser.add_argument("-p", "--processes", type=int, default=0,
+        help="Number of processes (0 - number of CPUs).")
+    parser.add_argument("-D", "--database", type=int, default=1,
+        choices=(1, 2))
+    parser.add_argument("-o", "--offset", type=float, default=0.0,
+        dest="starttime_offset",
+        help="Offset to add to specified starttime in seconds.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="Number of files of an event to load concurrently.")
+    parser.add_argument("--width", type=int, default=1600,
+        help="Image width in pixels.")
+    parser.add_argument("--force", action="store_true", default=False,
+        help="Render images that are up to date too.")
+    parser.add_argument("--packed24", action="store_true", default=False,
+        help="Read razr=24 files as packed 3-byte samples.")
+    options = parser.parse_args()
+    # процессы пула создаются после - наследуют настройку
+    set_packed24(options.packed24)
+    codes = list(options.codes)
+    if options.fromfile:
+        codes += [s.strip() for s in options.fromfile.readlines() if s.strip()]
+        # опции передаются в процессы, файл не сериализуется
+        options.fromfile = None
+    if not codes:
+        print("No events to render")
+        return
+    if not os.path.isdir(options.outdir):
+        os.makedirs(options.outdir)
+    pool = multiprocessing.Pool(options.processes or None, _init_worker)
+    try:
+        for code, status in pool.imap_unordered(_render,
+                [(code, options) for code in codes]):
+            print("%s: %s" % (code, status))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+STA/LTA сразу для многих каналов.
+
+Данные - двумерный массив (каналы x отсчёты), все каналы считаются за один
+проход numpy (без копирования потока ObsPy и цикла по трассам). Результаты
+совпадают с obspy.signal.trigger (classicSTALTA, recSTALTA).
+
+    from trigger import recursive_sta_lta, trigger_arrays
+    charfct = recursive_sta_lta(data, nsta=100, nlta=1000)
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+
+def classic_sta_lta(a, nsta, nlta):
+    """
+    Classic STA/LTA of array a (1-D or channels x samples) via cumulative
+    sums; nsta, nlta - window lengths in samples. First nlta - 1 values
+    are 0.
+    """
+    a = np.asarray(a)
+    sta = np.cumsum(np.square(a, dtype=np.float64), axis=-1)
+    lta = sta.copy()
+    # скользящие суммы как разности накопленных
+    sta[..., nsta:] -= sta[..., :-nsta].copy()
+    sta /= nsta
+    lta[..., nlta:] -= lta[..., :-nlta].copy()
+    lta /= nlta
+    sta[..., :nlta - 1] = 0
+    # не делить на 0
+    dtiny = np.finfo(0.0).tiny
+    lta[lta < dtiny] = dtiny
+    return sta / lta
+
+
+def _ema(x, c, y0):
+    """
+    y[n] = c * x[n] + (1 - c) * y[n - 1] along the last axis of x,
+    y[-1] = y0. The recursion is solved in closed form chunk by chunk:
+    y[n] = q**(n + 1) * y0 + c * q**n * cumsum(x[k] * q**-k), q = 1 - c;
+    chunks are short enough for q**-n not to overflow.
+    """
+    out = np.empty_like(x)
+    if c >= 1:
+        out[...] = x
+        return out
+    q = 1. - c
+    chunk = max(int(200. / -np.log(q)), 1)
+    y = np.empty(x.shape[:-1])
+    y.fill(y0)
+    npts = x.shape[-1]
+    for first in range(0, npts, chunk):
+        last = min(first + chunk, npts)
+        n = np.arange(last - first)
+        s = np.cumsum(x[..., first:last] * q ** -n, axis=-1)
+        out[..., first:last] = c * q ** n * s + \
+            q ** (n + 1) * y[..., np.newaxis]
+        y = out[..., last - 1]
+    return out
+
+
+def recursive_sta_lta(a, nsta, nlta):
+    """
+    Recursive STA/LTA of array a (1-D or channels x samples); nsta, nlta -
+    window lengths in samples. First nlta values are 0.
+    """
+    a = np.asarray(a)
+    charfct = np.zeros(a.shape)
+    if a.shape[-1] < 2:
+        return charfct
+    # как в obspy: рекурсия с первого отсчёта, sta = 0, lta = 1e-99
+    sq = np.square(a[..., 1:], dtype=np.float64)
+    sta = _ema(sq, 1. / nsta, 0.)
+    lta = _ema(sq, 1. / nlta, 1e-99)
+    charfct[..., 1:] = sta / lta
+    charfct[..., :nlta] = 0
+    return charfct
+
+
+METHODS = {
+    "recstalta": recursive_sta_lta,
+    "classicstalta": classic_sta_lta,
+}
+
+
+def trigger_arrays(arrays, sampling_rates, sta, lta, method="recstalta"):
+    """
+    Characteristic functions of arrays (one per trace) with given sampling
+    rates (list or a number), sta and lta in seconds. Arrays of the same
+    length and sampling rate are processed together as one 2-D array.
+    """
+    if np.isscalar(sampling_rates):
+        sampling_rates = [sampling_rates] * len(arrays)
+    func = METHODS[method]
+    groups = OrderedDict()
+    for i, (a, df) in enumerate(zip(arrays, sampling_rates)):
+        groups.setdefault((len(a), df), []).append(i)
+    result = [None] * len(arrays)
+    for (npts, df), indices in groups.iteritems():
+        if len(indices) == 1:
+            block = arrays[indices[0]][np.newaxis]
+        else:
+            block = np.vstack([arrays[i] for i in indices])
+        charfct = func(block, int(sta * df), int(lta * df))
+        for i, row in zip(indices, charfct):
+            result[i] = row
+    return result
+
+
+def trigger_traces(traces, sta, lta, method="recstalta"):
+    """
+    Characteristic functions of traces (Stream or list of traces), the
+    traces themselves are not changed.
+    """
+    return trigger_arrays([tr.data for tr in traces],
+        [tr.stats.sampling_rate for tr in traces], sta, lta, method)
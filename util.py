@@ -2,12 +2,18 @@
 import os
 import sys
 import datetime
+import threading
+import Queue
+from collections import OrderedDict
 
 import PyQt4
+from PyQt4 import QtCore
 import numpy as np
 import matplotlib as mpl
 from matplotlib.colors import ColorConverter
 from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+from matplotlib.ticker import FuncFormatter
 from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as QFigureCanvas
 from matplotlib.widgets import MultiCursor as MplMultiCursor
 
@@ -24,7 +30,8 @@ except ImportError:
 from obspy.core import UTCDateTime, Trace, Stream
 #from obspy.core import read
 
-from baikal import BaikalFile, get_time
+from baikal import BaikalFile, get_time, set_packed24
+from waveform_cache import DiskCache
 
 
 COMMANDLINE_OPTIONS = (
@@ -71,6 +78,123 @@ COMMANDLINE_OPTIONS = (
         'type': int, "default": 1,
         'choices': (1, 2),
     }),
+    # загружать только окно вокруг указанного времени
+    (("-w", "--window"), {
+        'type': float, 'nargs': 2, 'default': None,
+        'metavar': ("BEFORE", "AFTER"),
+        'help': "Load only BEFORE..AFTER seconds around --datetime."
+    }),
+    # число потоков для загрузки файлов
+    (("-j", "--jobs"), {
+        'type': int, 'default': 4,
+        'help': "Number of files to load concurrently."
+    }),
+    # время операций (переход между потоками и т.п.) в консоль
+    (("--debug",), {
+        'action': "store_true", 'default': False, 'dest': "debug",
+        'help': "Print timings of plot updates."
+    }),
+    # размер кэша трасс
+    (("--cache-size",), {
+        'type': int, 'default': 512, 'dest': "cache_size",
+        'help': "Memory budget of decoded traces cache in MB."
+    }),
+    # дисковый кэш декодированных файлов
+    (("--disk-cache",), {
+        'default': None, 'dest': "disk_cache",
+        'help': "Directory of on-disk cache of decoded files (.npy)."
+    }),
+    (("--disk-cache-size",), {
+        'type': int, 'default': 2048, 'dest': "disk_cache_size",
+        'help': "Size limit of on-disk cache in MB."
+    }),
+    # файлы razr=24 с упакованными 3-байтовыми отсчётами
+    (("--packed24",), {
+        'action': "store_true", 'default': False, 'dest': "packed24",
+        'help': "Read razr=24 files as packed 3-byte samples "
+                "(default: 4-byte samples)."
+    }),
+    # параметры AR picker (obspy.signal.arPick)
+    (("--ar-f1",), {
+        'type': float, 'default': 1.0, 'dest': "ar_f1",
+        'help': "Frequency for lower bandpass cutoff of AR picker."
+    }),
+    (("--ar-f2",), {
+        'type': float, 'default': 20.0, 'dest': "ar_f2",
+        'help': "Frequency for upper bandpass cutoff of AR picker."
+    }),
+    (("--ar-sta-p",), {
+        'type': float, 'default': 0.1, 'dest': "ar_sta_p",
+        'help': "Length of STA for P arrival of AR picker (s)."
+    }),
+    (("--ar-lta-p",), {
+        'type': float, 'default': 1.0, 'dest': "ar_lta_p",
+        'help': "Length of LTA for P arrival of AR picker (s)."
+    }),
+    (("--ar-sta-s",), {
+        'type': float, 'default': 1.0, 'dest': "ar_sta_s",
+        'help': "Length of STA for S arrival of AR picker (s)."
+    }),
+    (("--ar-lta-s",), {
+        'type': float, 'default': 4.0, 'dest': "ar_lta_s",
+        'help': "Length of LTA for S arrival of AR picker (s)."
+    }),
+    (("--ar-m-p",), {
+        'type': int, 'default': 2, 'dest': "ar_m_p",
+        'help': "Number of AR coefficients for P arrival of AR picker."
+    }),
+    (("--ar-m-s",), {
+        'type': int, 'default': 8, 'dest': "ar_m_s",
+        'help': "Number of AR coefficients for S arrival of AR picker."
+    }),
+    (("--ar-l-p",), {
+        'type': float, 'default': 0.1, 'dest': "ar_l_p",
+        'help': "Length of variance window for P arrival of AR picker (s)."
+    }),
+    (("--ar-l-s",), {
+        'type': float, 'default': 0.2, 'dest': "ar_l_s",
+        'help': "Length of variance window for S arrival of AR picker (s)."
+    }),
+    (("--ar-processes",), {
+        'type': int, 'default': 0, 'dest': "ar_processes",
+        'help': "Number of processes for AR picker (0 - number of CPUs)."
+    }),
+    # автоматические пикировки без GUI
+    (("--autopick",), {
+        'action': "store_true", 'default': False,
+        'help': "Set P and S picks of events (idDir codes from arguments, "
+                "--fromfile or --date-range) with AR picker, without GUI."
+    }),
+    (("--date-range",), {
+        'nargs': 2, 'default': None, 'dest': "date_range",
+        'metavar': ("START", "END"),
+        'help': "Events from START to END date (format like 2013-02-14)."
+    }),
+    (("--picks-out",), {
+        'default': None, 'dest': "picks_out",
+        'help': "Write automatic picks to file instead of database."
+    }),
+    (("--batch-size",), {
+        'type': int, 'default': 10, 'dest': "batch_size",
+        'help': "Number of events picked together with --autopick."
+    }),
+    # кэш отфильтрованных данных для отображения
+    (("--filter-cache-size",), {
+        'type': int, 'default': 256, 'dest': "filter_cache_size",
+        'help': "Memory budget of filtered data cache in MB."
+    }),
+    # число станций, одновременно видимых в обзоре
+    (("--rows",), {
+        'type': int, 'default': 20, 'dest': "overview_rows",
+        'help': "Number of streams shown at once in the overview "
+                "(scroll with Ctrl+wheel or the next/previous stream keys)."
+    }),
+    # поиск по локальному индексу архива вместо базы данных
+    (("-x", "--index"), {
+        'default': None,
+        'help': "Archive index file (see archive_index.py) to search "
+                "--datetime in without database."
+    }),
 )
 
 
@@ -165,8 +289,65 @@ def matplotlib_color_to_rgb(color):
     rgb = ColorConverter().to_rgb(color)
     return [int(_i*255) for _i in rgb]
 
+class PickOverlay(object):
+    """
+    Animated artists (pick lines, labels, cursor) drawn over a cached image
+    of the figure. A full canvas draw renders the waveforms once and caches
+    the background; changes of the overlay only blit the overlay artists.
+    """
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.artists = []
+        self.background = None
+        self.cid = canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add(self, artist):
+        """ draw artist on the overlay (not with the background) """
+        artist.set_animated(True)
+        self.artists.append(artist)
+        return artist
+
+    def remove(self, artist):
+        """ remove artist from the overlay and from its axes """
+        self.discard(artist)
+        artist.remove()
+
+    def discard(self, artist):
+        """ stop drawing artist (e.g. its axes were deleted) """
+        if artist in self.artists:
+            self.artists.remove(artist)
+
+    def on_draw(self, event):
+        # фон - без анимированных объектов, которые дорисовываем сами
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        figure = self.canvas.figure
+        for artist in self.artists:
+            if artist.axes not in figure.axes:
+                continue
+            artist.axes.draw_artist(artist)
+
+    def update(self):
+        """ redraw the overlay over the cached background """
+        if self.background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+
 class MultiCursor(MplMultiCursor):
-    def __init__(self, canvas, axes, useblit=True, **lineprops):
+    """
+    Cursor across all axes. With an overlay (PickOverlay) the cursor lines
+    are blitted together with the other overlay artists. With motion=False
+    onmove is not connected to the canvas and has to be called by the owner
+    (e.g. from a MotionCoalescer handler).
+    """
+    def __init__(self, canvas, axes, useblit=True, overlay=None, motion=True,
+                 **lineprops):
         self.canvas = canvas
         self.axes = axes
         xmin, xmax = axes[-1].get_xlim()
@@ -176,9 +357,86 @@ class MultiCursor(MplMultiCursor):
         self.useblit = useblit
         self.background = None
         self.needclear = False
-        self.id1=self.canvas.mpl_connect('motion_notify_event', self.onmove)
+        self.overlay = overlay
+        if overlay is not None:
+            for line in self.lines:
+                overlay.add(line)
+        self.id1 = None
+        if motion:
+            self.id1=self.canvas.mpl_connect('motion_notify_event', self.onmove)
         self.id2=self.canvas.mpl_connect('draw_event', self.clear)
-    
+
+    def disconnect(self):
+        """ disconnect events and remove the cursor lines (from the overlay
+        and the axes) """
+        if self.id1 is not None:
+            self.canvas.mpl_disconnect(self.id1)
+        self.canvas.mpl_disconnect(self.id2)
+        for line in self.lines:
+            if self.overlay is not None:
+                self.overlay.discard(line)
+            # оси переиспользуются (пул осей) - убрать линию и из них
+            try:
+                line.remove()
+            except ValueError:
+                pass
+
+    def clear(self, event):
+        if self.useblit and self.overlay is None:
+            self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        for line in self.lines:
+            line.set_visible(False)
+
+    def onmove(self, event):
+        if event.inaxes is None:
+            return
+        if not self.canvas.widgetlock.available(self):
+            return
+        self.needclear = True
+        if not self.visible:
+            return
+        for line in self.lines:
+            line.set_xdata((event.xdata, event.xdata))
+            line.set_visible(self.visible)
+        self._update()
+
+    def _update(self):
+        if self.overlay is not None:
+            self.overlay.update()
+        elif self.useblit:
+            if self.background is not None:
+                self.canvas.restore_region(self.background)
+            for ax, line in zip(self.axes, self.lines):
+                ax.draw_artist(line)
+            self.canvas.blit(self.canvas.figure.bbox)
+        else:
+            self.canvas.draw_idle()
+
+
+class MotionCoalescer(object):
+    """
+    Calls handler with the latest mouse motion event of the canvas at most
+    once per interval ms (a display frame); events in between are dropped.
+    """
+    def __init__(self, canvas, handler, interval=16):
+        self.handler = handler
+        self.event = None
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        QtCore.QObject.connect(self.timer, QtCore.SIGNAL("timeout()"), self.fire)
+        self.cid = canvas.mpl_connect('motion_notify_event', self.on_motion)
+
+    def on_motion(self, event):
+        self.event = event
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def fire(self):
+        event, self.event = self.event, None
+        if event is not None:
+            self.handler(event)
+
 
 def formatXTicklabels(x, *pos):
     """
@@ -194,6 +452,180 @@ def formatXTicklabels(x, *pos):
     else:
         return "%.3f" % x
 
+class TimeAxis(object):
+    """
+    Sample times of a trace (start + i * delta, i < npts) computed on demand
+    instead of being kept as an array of the size of the data.
+    """
+    def __init__(self, start, delta, npts):
+        self.start = start
+        self.delta = delta
+        self.npts = npts
+
+    @classmethod
+    def from_trace(cls, tr, reftime):
+        """ time axis of the trace relative to reftime (UTCDateTime) """
+        return cls(tr.stats.starttime - reftime, tr.stats.delta, tr.stats.npts)
+
+    @property
+    def end(self):
+        """ time of the last sample """
+        return self.start + (self.npts - 1) * self.delta
+
+    def __len__(self):
+        return self.npts
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.start + self.delta * np.arange(*item.indices(self.npts))
+        i = int(item)
+        if i < 0:
+            i += self.npts
+        if not 0 <= i < self.npts:
+            raise IndexError("sample index out of range")
+        return self.start + i * self.delta
+
+    def __array__(self, dtype=None):
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+    def index(self, x):
+        """ index of the sample nearest to time x """
+        i = int(round((x - self.start) / self.delta))
+        return min(max(i, 0), self.npts - 1)
+
+    def snap(self, x):
+        """ time of the sample nearest to time x """
+        return self[self.index(x)]
+
+    def __repr__(self):
+        return "TimeAxis(start=%r, delta=%r, npts=%r)" % (self.start,
+            self.delta, self.npts)
+
+
+def minmax_envelope(data, start, delta, xmin, xmax, ncols):
+    """
+    Reduce the samples of a trace (first sample at time start, sampling
+    interval delta) visible in [xmin, xmax] to min/max pairs per pixel
+    column (ncols columns). When there are less than two samples per column
+    the samples themselves are returned.
+    Returns arrays of times and values for plotting.
+    """
+    npts = len(data)
+    # один отсчёт за краями окна, чтобы линия доходила до границ осей
+    first = int(min(max(np.floor((xmin - start) / delta), 0), npts))
+    last = int(max(min(np.ceil((xmax - start) / delta) + 1, npts), first))
+    n = last - first
+    ncols = max(int(ncols), 1)
+    if n < 2 * ncols:
+        return start + delta * np.arange(first, last), data[first:last]
+    step = n // ncols
+    full = n // step * step
+    bins = data[first:first + full].reshape(-1, step)
+    mins, maxs = bins.min(axis=1), bins.max(axis=1)
+    if full < n:
+        tail = data[first + full:last]
+        mins = np.append(mins, tail.min())
+        maxs = np.append(maxs, tail.max())
+    values = np.empty(2 * len(mins), dtype=mins.dtype)
+    values[0::2] = mins
+    values[1::2] = maxs
+    # минимум и максимум - в середине столбца
+    times = start + delta * (first + step * (np.arange(len(mins)) + 0.5))
+    return np.repeat(times, 2), values
+
+
+def setup_overview_axes(fig, T0):
+    """
+    Single axes of the record section (stream overview) in figure fig:
+    one LineCollection for all rows, time ticks relative to T0, T0 as
+    title. Returns (axes, collection, title).
+    """
+    ax = fig.add_subplot(111)
+    collection = LineCollection([], colors='k', linewidths=0.5, zorder=1000)
+    ax.add_collection(collection)
+    ax.xaxis.set_major_formatter(FuncFormatter(formatXTicklabels))
+    ax.xaxis.set_ticks_position("both")
+    ax.yaxis.set_tick_params(direction="in", pad=-5)
+    label = T0.isoformat().replace("T", "  ")
+    title = fig.suptitle(label, ha="left", va="bottom", x=0.01, y=0.01)
+    fig.subplots_adjust(bottom=0.001, hspace=0.000, right=0.999, top=0.999, left=0.001)
+    return ax, collection, title
+
+
+def set_overview_rows(ax, offsets, ids):
+    """ trace ids as tick labels of overview rows at offsets """
+    ax.set_yticks(offsets)
+    ax.set_yticklabels(ids, ha="left", family='monospace', color="blue")
+
+
+def overview_scale(data):
+    """ scale of trace data to half the row spacing of the overview """
+    amax = abs(data).max() if len(data) else 0
+    return 0.5 / amax if amax else 1.0
+
+
+def overview_segment(data, scale, t, offset, xmin, xmax, ncols):
+    """
+    Trace (data with TimeAxis t) in overview row offset for x-range
+    [xmin, xmax] and ncols pixel columns, as a LineCollection segment.
+    """
+    x, y = minmax_envelope(data, t.start, t.delta, xmin, xmax, ncols)
+    return np.column_stack((x, y * scale + offset))
+
+
+def batch_spectrogram(data, start, delta, wlen, per_lap, xmin, xmax, ncols,
+                      log=False):
+    """
+    Spectrograms of all channels of a stream (list of arrays, first sample
+    at time start, sampling interval delta) for x-range [xmin, xmax] in one
+    vectorised STFT. Window length wlen (s) is rounded up to a power of 2
+    samples, windows overlap by per_lap, but there are at most about ncols
+    windows (one per pixel column). With log frequencies are resampled to
+    log-spaced rows, y-range then is log10 of frequency.
+    Returns (amplitudes of shape (channels, rows, windows), extent for
+    imshow) or None if the range is shorter than a window.
+    """
+    npts = max(len(d) for d in data)
+    nfft = 2 ** int(np.ceil(np.log2(max(wlen / delta, 2))))
+    # пол-окна за краями, чтобы окна покрывали весь видимый интервал
+    first = int(max(np.floor((xmin - start) / delta) - nfft // 2, 0))
+    last = int(min(np.ceil((xmax - start) / delta) + nfft // 2 + 1, npts))
+    n = last - first
+    if n < nfft:
+        return
+    ncols = max(int(ncols), 1)
+    hop = max(int(nfft * (1 - per_lap)), 1,
+              int(np.ceil((n - nfft) / float(ncols))))
+    nwin = (n - nfft) // hop + 1
+    # все каналы - в одном массиве (короткие дополнены нулями)
+    segment = np.zeros((len(data), n), dtype=np.float64)
+    for i, d in enumerate(data):
+        d = d[first:last]
+        segment[i, :len(d)] = d
+    s0, s1 = segment.strides
+    windows = np.lib.stride_tricks.as_strided(segment,
+        shape=(len(data), nwin, nfft), strides=(s0, hop * s1, s1))
+    windows = windows - windows.mean(axis=-1)[..., np.newaxis]
+    windows *= np.hanning(nfft)
+    spec = np.abs(np.fft.rfft(windows, axis=-1)).astype(np.float32)
+    # (каналы, частоты, окна)
+    spec = spec.transpose(0, 2, 1)
+    fmax = 0.5 / delta
+    if log:
+        nfreq = spec.shape[1] - 1
+        fmin = 1. / (nfft * delta)
+        freqs = np.logspace(np.log10(fmin), np.log10(fmax), nfreq)
+        rows = np.round(freqs * nfft * delta).astype(int)
+        spec = spec[:, rows, :]
+        y0, y1 = np.log10(fmin), np.log10(fmax)
+    else:
+        y0, y1 = 0., fmax
+    # центры окон
+    times = start + delta * (first + hop * np.arange(nwin) + nfft / 2.)
+    half = 0.5 * hop * delta
+    return spec, (times[0] - half, times[-1] + half, y0, y1)
+
+
 class SplitWriter():
     """
     Implements a write method that writes a given message on all children
@@ -268,6 +700,7 @@ INNER JOIN "prnbase01_prns"
 ON "prnbase01_prns"."idPrn" = "prnbase01_prnswaves"."idPrn"
 WHERE "prnbase01_prnswaves"."idPrn" = %s
 AND "prnbase01_prnswaves"."NameWave" NOT LIKE '__m'
+AND "prnbase01_prnswaves"."NameWave" NOT IN ('Pa', 'Sa')
 ;\
 """
 #--AND "seisobr_prnswaves"."NameWave" NOT LIKE '%m'
@@ -279,6 +712,23 @@ UPDATE "prnbase{code}_prnswaves"
 SET "TimeWave"=%s
 WHERE "idWave"=%s;'''.format(**{"code": "%02d"%1})
 
+# автоматические пикировки (см. AUTOPICK_WAVES)
+INSERT_WAVES = 'INSERT INTO "prnbase01_prnswaves" ("idPrn", "NameWave", "TimeWave") VALUES (%s, %s, %s);'
+DELETE_AUTOPICK_WAVES = 'DELETE FROM "prnbase01_prnswaves" WHERE "idPrn"=%s AND "NameWave" IN (\'Pa\', \'Sa\');'
+
+# названия волн для автоматических пикировок (SELECT_WAVES их не выбирает,
+# чтобы они не подменяли пикировки аналитика)
+AUTOPICK_WAVES = {'P': "Pa", 'S': "Sa"}
+
+# коды idDir событий за интервал дат
+SELECT_DIRS_BY_DATE = """\
+SELECT DISTINCT "prnbase01_prns"."idDir"
+FROM "prnbase01_prns"
+WHERE "prnbase01_prns"."DateE" BETWEEN %s AND %s
+ORDER BY "prnbase01_prns"."idDir"
+;\
+"""
+
 
 # выбрать из таблицы prns ближайшее значение за указанную дату
 SEARCH_BY_DATETIME = '''\
@@ -297,6 +747,22 @@ ORDER BY "prnbase01_prns"."TimeE"
 LIMIT 3
 '''
 
+# все файлы, известные базе данных (для сверки с локальным индексом)
+SELECT_ALL_FILES = """\
+SELECT "prnbase01_prnsdir"."Path", "prnbase01_prns"."seisFile"
+FROM "prnbase01_prns"
+INNER JOIN "prnbase01_prnsdir"
+ON "prnbase01_prnsdir"."idDir" = "prnbase01_prns"."idDir"
+;\
+"""
+
+
+def db_path2filename(Dir, fname):
+    """ путь к файлу из записи в базе данных (папка в стиле windows) -
+    относительно DATA_DIR """
+    Dir = Dir[Dir.index(DATA_DIR):].replace("\\", "/")
+    return os.path.join(Dir, fname)
+
 
 def execute_query(cursor, query, params):
     """ ищем записи """
@@ -323,9 +789,206 @@ def setup_db_connection():
 
 #=== BAIKAL data handling
 
-def get_traces_from_baikal_file(filename):
-    # загружать данные из файла формата Байкал
-    bf = BaikalFile(filename)
+class TraceCache(object):
+    """
+    Process-wide LRU cache of decoded traces with a memory budget.
+    Keys identify the file by (path, mtime, size) and the time window read.
+    """
+    def __init__(self, max_mb=512):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.items = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # файлы могут загружаться в нескольких потоках
+        self.lock = threading.Lock()
+
+    def key(self, filename, starttime=None, endtime=None):
+        st = os.stat(filename)
+        return (os.path.abspath(filename), st.st_mtime, st.st_size,
+                str(starttime), str(endtime))
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return
+            self.hits += 1
+            # самый свежий - в конец
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value[0]
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def put(self, key, value, nbytes):
+        with self.lock:
+            if key in self.items:
+                self.nbytes -= self.items.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self.items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def set_budget(self, max_mb):
+        with self.lock:
+            self.max_bytes = max_mb * 1024 * 1024
+            self._evict()
+
+    def _evict(self):
+        # выбрасывать давно не использованные, пока не уложимся в бюджет
+        while self.nbytes > self.max_bytes and self.items:
+            _, (_, nbytes) = self.items.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            'items': len(self.items), 'MB': self.nbytes / 1024. / 1024,
+            'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __str__(self):
+        return ("Trace cache: %(items)d files, %(MB).1f MB, %(hits)d hits, "
+                "%(misses)d misses, %(evictions)d evictions" % self.stats())
+
+TRACE_CACHE = TraceCache()
+
+
+def stream_key(traces):
+    """ key identifying the data of traces (Stream or list of traces) """
+    return tuple((tr.id, str(tr.stats.starttime), tr.stats.npts)
+                 for tr in traces)
+
+
+class StreamPrefetcher(object):
+    """
+    Prepares streams for display in a background thread.
+
+    prepare(index, settings, *args) must not touch the GUI: settings
+    describe everything the result depends on (filter, normalization...).
+    Requests with other settings cancel queued and running work for the
+    old ones, their results are dropped. Only the max_items latest results
+    are kept.
+    """
+    def __init__(self, prepare, max_items=4):
+        self.prepare = prepare
+        self.max_items = max_items
+        self.settings = None
+        self.generation = 0
+        self.results = OrderedDict()
+        self.pending = set()
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def request(self, index, settings, *args):
+        """ prepare stream index in background (if not done yet) """
+        with self.lock:
+            if settings != self.settings:
+                self._invalidate(settings)
+            if index in self.results or index in self.pending:
+                return
+            self.pending.add(index)
+            self.queue.put((self.generation, index, settings, args))
+
+    def get(self, index, settings):
+        """ prepared result for stream index or None """
+        with self.lock:
+            if settings != self.settings:
+                return
+            return self.results.get(index)
+
+    def is_pending(self, index, settings):
+        """ stream index is queued or being prepared with settings """
+        with self.lock:
+            return settings == self.settings and index in self.pending
+
+    def invalidate(self, settings=None):
+        """ drop all results and cancel queued work """
+        with self.lock:
+            self._invalidate(settings)
+
+    def _invalidate(self, settings):
+        self.settings = settings
+        self.generation += 1
+        self.results.clear()
+        self.pending.clear()
+
+    def _run(self):
+        while True:
+            generation, index, settings, args = self.queue.get()
+            if generation != self.generation:
+                # отменено - настройки поменялись
+                continue
+            try:
+                result = self.prepare(index, settings, *args)
+            except Exception, e:
+                result = None
+                sys.__stderr__.write("Prefetch of stream %d failed: %s\n" % (
+                    index, e))
+            with self.lock:
+                if generation != self.generation:
+                    continue
+                self.pending.discard(index)
+                if result is not None:
+                    self.results[index] = result
+                    while len(self.results) > self.max_items:
+                        self.results.popitem(last=False)
+
+# дисковый кэш декодированных файлов (waveform_cache.DiskCache), если включён
+DISK_CACHE = None
+
+
+def set_disk_cache(directory, max_mb=2048):
+    """ включить (directory=None - выключить) дисковый кэш """
+    global DISK_CACHE
+    DISK_CACHE = DiskCache(directory, max_mb) if directory else None
+
+
+def get_traces_from_baikal_file(filename, mmap=False, starttime=None, endtime=None):
+    # загружать данные из файла формата Байкал через кэш трасс TRACE_CACHE
+    # (mmap=True - данные трасс отображаются из файла без копирования,
+    # starttime/endtime - читать только кадры из этого окна времени)
+    try:
+        key = TRACE_CACHE.key(filename, starttime, endtime)
+    except OSError:
+        # нет файла - сообщит read_traces_from_baikal_file
+        key = None
+    cached = TRACE_CACHE.get(key) if key else None
+    if cached is None:
+        traces = read_traces_from_baikal_file(filename, mmap, starttime, endtime)
+        if traces is None:
+            return
+        # данные в кэше только для чтения: изменять их надо в копии трасс
+        for tr in traces:
+            tr.data.flags.writeable = False
+        cached = [(tr.stats, tr.data) for tr in traces]
+        if key:
+            TRACE_CACHE.put(key, cached, sum(tr.data.nbytes for tr in traces))
+    # новые трассы с общими (не копированными) данными
+    return [Trace(header=dict(stats), data=data) for stats, data in cached]
+
+
+def read_traces_from_baikal_file(filename, mmap=False, starttime=None, endtime=None):
+    # загружать данные из файла формата Байкал (без кэша в памяти);
+    # если включён дисковый кэш - данные отображаются из него
+    if DISK_CACHE is not None and os.path.exists(filename):
+        bf = DISK_CACHE.open(filename, starttime, endtime)
+    else:
+        bf = BaikalFile(filename, mmap=mmap, starttime=starttime, endtime=endtime)
     if not bf.valid:
         print("\nSkipping file %s" % filename)
         return
@@ -339,6 +1002,8 @@ def get_traces_from_baikal_file(filename):
         int(_hour), int(_minute), _seconds,
         precision=3,# digits after point
     )
+    # начало прочитанного окна
+    utcdatetime += bf.first_frame * bf.main_header.dt
     # все каналы (трассы) из файла
     traces = []
     for i, channel in enumerate(bf.channels):
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Дисковый кэш декодированных файлов Байкал.
+
+Каналы сохраняются демультиплексированными в .npy (отображается в память
+без разбора исходного файла), заголовки - в .json рядом. Запись кэша
+действительна, пока у исходного файла те же размер, время модификации и
+хэш заголовков.
+
+    python waveform_cache.py prune CACHE_DIR --max-size 2048
+    python waveform_cache.py clear CACHE_DIR
+"""
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+from baikal import BaikalHeader, BaikalFile, MyDictClass
+
+
+def _str(value):
+    """ json возвращает unicode - строки заголовков храним как str
+    (записываются как latin-1, чтобы сохранить любые байты) """
+    if isinstance(value, unicode):
+        return value.encode("latin-1")
+    return value
+
+
+def _replace(src, dst):
+    """ переименовать src в dst, заменяя существующий (и в windows) """
+    if os.path.exists(dst): os.remove(dst)
+    os.rename(src, dst)
+
+
+class CachedBaikalFile(BaikalHeader):
+    """ файл Байкал, восстановленный из кэша (атрибуты как у BaikalFile) """
+    def __init__(self, filename, main_header, channels, data,
+                 starttime=None, endtime=None):
+        self.filename = filename
+        self.valid = True
+        self.main_header = main_header
+        self.channels = channels
+        self._data = data
+        first, last = self.frame_range(starttime, endtime)
+        self.first_frame = first
+        self.data = data[:, first:last]
+
+    @property
+    def nframes(self):
+        return self._data.shape[1]
+
+    npts = nframes
+
+
+class DiskCache(object):
+    """ кэш в папке directory, размером не более max_mb мегабайт """
+    def __init__(self, directory, max_mb=2048):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _paths(self, filename):
+        """ файлы записи кэша для исходного файла: (.npy, .json) """
+        name = hashlib.md5(os.path.abspath(filename)).hexdigest()
+        base = os.path.join(self.directory, name)
+        return base + ".npy", base + ".json"
+
+    @staticmethod
+    def header_hash(filename, nkan):
+        """ хэш главного заголовка и заголовков каналов исходного файла """
+        with open(filename, 'rb') as _f:
+            return hashlib.md5(_f.read(120 + 72 * nkan)).hexdigest()
+
+    def load(self, filename, starttime=None, endtime=None):
+        """ CachedBaikalFile из кэша или None, если записи нет или она
+        устарела """
+        npy, meta = self._paths(filename)
+        try:
+            with open(meta) as _f:
+                info = json.load(_f)
+            st = os.stat(filename)
+        except (IOError, OSError, ValueError):
+            return
+        if (info["size"], info["mtime"]) != (st.st_size, st.st_mtime):
+            return
+        main_header = MyDictClass((_str(k), _str(v))
+            for k, v in info["main_header"].iteritems())
+        channels = [MyDictClass((_str(k), _str(v)) for k, v in ch.iteritems())
+            for ch in info["channels"]]
+        if self.header_hash(filename, main_header.kan) != info["header_hash"]:
+            return
+        try:
+            data = np.load(npy, mmap_mode="r")
+        except (IOError, ValueError):
+            return
+        bf = CachedBaikalFile(filename, main_header, channels, data,
+            starttime, endtime)
+        # файл razr=24 мог быть декодирован с другой длиной отсчёта
+        if info.get("sample_size") != bf.sample_size:
+            return
+        # отметить использование (для удаления давно не использованных)
+        os.utime(meta, None)
+        return bf
+
+    def store(self, bf):
+        """ записать весь файл (BaikalFile) в кэш """
+        npy, meta = self._paths(bf.filename)
+        st = os.stat(bf.filename)
+        # сначала во временные файлы, чтобы не оставить половину записи
+        tmp = npy + ".tmp.npy"
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=bf.data.dtype,
+            shape=bf.data.shape)
+        # каждый канал - непрерывно
+        for i in range(bf.data.shape[0]):
+            out[i] = bf.data[i]
+        out.flush()
+        del out
+        _replace(tmp, npy)
+        info = {
+            "filename": os.path.abspath(bf.filename),
+            "size": st.st_size, "mtime": st.st_mtime,
+            "header_hash": self.header_hash(bf.filename, bf.main_header.kan),
+            "sample_size": bf.sample_size,
+            "main_header": bf.main_header,
+            "channels": bf.channels,
+        }
+        with open(meta + ".tmp", "w") as _f:
+            json.dump(info, _f, encoding="latin-1")
+        _replace(meta + ".tmp", meta)
+        self.prune()
+
+    def open(self, filename, starttime=None, endtime=None):
+        """ файл из кэша, а при промахе - прочитать весь файл, сохранить
+        в кэш и вернуть нужное окно """
+        bf = self.load(filename, starttime, endtime)
+        if bf is not None:
+            return bf
+        bf = BaikalFile(filename, mmap=True)
+        if not bf.valid:
+            return bf
+        if bf.data.nbytes > self.max_bytes:
+            # больше всего кэша - записали бы и сразу удалили
+            return BaikalFile(filename, starttime=starttime, endtime=endtime)
+        try:
+            self.store(bf)
+        except (IOError, OSError), msg:
+            print("Could not write cache for %s: %s" % (filename, msg))
+            return BaikalFile(filename, starttime=starttime, endtime=endtime)
+        return self.load(filename, starttime, endtime) or \
+            BaikalFile(filename, starttime=starttime, endtime=endtime)
+
+    def entries(self):
+        """ записи кэша: (время последнего использования, размер, файлы) """
+        result = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            meta = os.path.join(self.directory, name)
+            npy = meta[:-len(".json")] + ".npy"
+            try:
+                size = os.path.getsize(meta)
+                if os.path.exists(npy): size += os.path.getsize(npy)
+                result += [(os.path.getmtime(meta), size, (npy, meta))]
+            except OSError:
+                continue
+        return result
+
+    def prune(self, max_mb=None):
+        """ удалить давно не использованные записи, пока кэш больше
+        max_mb мегабайт; возвращает число удалённых записей """
+        max_bytes = self.max_bytes if max_mb is None else max_mb * 1024 * 1024
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, paths in entries:
+            if total <= max_bytes:
+                break
+            for path in paths:
+                if os.path.exists(path): os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        return self.prune(0)
+
+
+def main():
+    """ обслуживание кэша из командной строки """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=("prune", "clear"))
+    parser.add_argument("directory", help="Cache directory.")
+    parser.add_argument("--max-size", type=int, default=2048, dest="max_size",
+        help="Cache size limit in MB.")
+    options = parser.parse_args()
+    cache = DiskCache(options.directory, options.max_size)
+    if options.command == "prune":
+        removed = cache.prune()
+    else:
+        removed = cache.clear()
+    print("Removed %d cache entries" % removed)
+
+
+if __name__ == "__main__":
+    main()